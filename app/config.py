@@ -6,7 +6,7 @@ from neo4j import GraphDatabase
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from fastapi import HTTPException, status
-from redis.asyncio import Redis   # async Redis for presence tracking
+from redis.asyncio import Redis, BlockingConnectionPool   # async Redis for presence tracking
 
 # =========================================================
 #  Environment setup
@@ -47,6 +47,10 @@ neomodel_config.DATABASE_NAME = NEO4J_DATABASE
 print(f"[ℹ️] Neomodel connected → {neomodel_config.DATABASE_URL}")
 print(f"[ℹ️] Using database     → {NEO4J_DATABASE}")
 
+# Messages per MessageBucket. Bucket ids are derived from it, so never change it
+# once messages exist.
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", 1000))
+
 # =========================================================
 #  Redis configuration  (non‑TLS by default)
 # =========================================================
@@ -55,10 +59,76 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", 13027))
 REDIS_USERNAME = os.getenv("REDIS_USERNAME", "default")
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
 REDIS_SSL = os.getenv("REDIS_SSL", "false").lower() == "true"
+# Connections shared by everything that talks to Redis (presence, cache, pub/sub, …);
+# callers wait up to REDIS_POOL_TIMEOUT seconds for a free one
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
 
-# Create placeholder; FastAPI sets it on startup
+# Create placeholders; FastAPI sets them on startup
+redis_pool: BlockingConnectionPool | None = None
 redis_client: Redis | None = None
 
+# Hot cache of the most recent serialized messages per conversation
+RECENT_MESSAGES_CACHE_SIZE = int(os.getenv("RECENT_MESSAGES_CACHE_SIZE", 50))
+RECENT_MESSAGES_CACHE_TTL = int(os.getenv("RECENT_MESSAGES_CACHE_TTL", 60 * 60 * 24))
+
+# Dedupe window for client-generated message ids (retries within it return the original)
+CLIENT_MESSAGE_ID_TTL = int(os.getenv("CLIENT_MESSAGE_ID_TTL", 60 * 60 * 24))
+# How long an in-flight claim holds before a retry may take over (crashed sender)
+CLIENT_MESSAGE_ID_PENDING_TTL = int(os.getenv("CLIENT_MESSAGE_ID_PENDING_TTL", 30))
+
+# Fan WebSocket broadcasts out through Redis pub/sub so every worker/instance sees them
+WS_BROKER_ENABLED = os.getenv("WS_BROKER_ENABLED", "true").lower() == "true"
+
+# Per-connection outbound queue; when a slow client fills it: "drop_oldest" | "disconnect"
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest").lower()
+
+# Heartbeat: ping opted-in sockets every WS_PING_INTERVAL s, close them when silent for WS_IDLE_TIMEOUT s
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", 25))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 75))
+
+# Minimum seconds between relayed typing / read-ack events per user and conversation
+WS_TYPING_THROTTLE = float(os.getenv("WS_TYPING_THROTTLE", 2))
+WS_READ_ACK_THROTTLE = float(os.getenv("WS_READ_ACK_THROTTLE", 1))
+
+# Chat send rate limits (token buckets): messages/second and burst size
+WS_RATE_PER_CONNECTION = float(os.getenv("WS_RATE_PER_CONNECTION", 5))
+WS_BURST_PER_CONNECTION = float(os.getenv("WS_BURST_PER_CONNECTION", 10))
+WS_RATE_PER_USER = float(os.getenv("WS_RATE_PER_USER", 10))       # across all sockets and workers
+WS_BURST_PER_USER = float(os.getenv("WS_BURST_PER_USER", 20))
+
+# Offline delivery: per-user pending streams for members without a /ws socket
+WS_PENDING_MAXLEN = int(os.getenv("WS_PENDING_MAXLEN", 500))
+WS_PENDING_TTL = int(os.getenv("WS_PENDING_TTL", 60 * 60 * 24 * 7))
+WS_ONLINE_TTL = int(os.getenv("WS_ONLINE_TTL", WS_IDLE_TIMEOUT * 2))
+WS_MEMBER_CACHE_TTL = float(os.getenv("WS_MEMBER_CACHE_TTL", 60))
+
+# GET /ws/metrics needs `Authorization: Bearer <WS_METRICS_TOKEN>`; unset → endpoint off
+WS_METRICS_TOKEN = os.getenv("WS_METRICS_TOKEN")
+
+# Large-group fan-out: rooms with this many sockets on a worker coalesce message
+# bursts into batch frames and fan out in shards
+WS_LARGE_ROOM_SIZE = int(os.getenv("WS_LARGE_ROOM_SIZE", 200))
+WS_COALESCE_WINDOW_MS = float(os.getenv("WS_COALESCE_WINDOW_MS", 5))
+WS_FANOUT_SHARD_SIZE = int(os.getenv("WS_FANOUT_SHARD_SIZE", 256))
+
+# Graceful drain on shutdown: clients are told to reconnect after a random
+# delay in [MIN, MAX] seconds; queued frames get up to WS_DRAIN_TIMEOUT to flush
+WS_DRAIN_TIMEOUT = float(os.getenv("WS_DRAIN_TIMEOUT", 10))
+WS_RECONNECT_MIN_DELAY = float(os.getenv("WS_RECONNECT_MIN_DELAY", 1))
+WS_RECONNECT_MAX_DELAY = float(os.getenv("WS_RECONNECT_MAX_DELAY", 30))
+
+# =========================================================
+#  Message archive (cold storage for old history)
+# =========================================================
+ARCHIVE_BACKEND = os.getenv("ARCHIVE_BACKEND", "local").lower()      # "s3" | "local"
+ARCHIVE_LOCAL_DIR = os.getenv("ARCHIVE_LOCAL_DIR", "archive")
+ARCHIVE_S3_BUCKET = os.getenv("ARCHIVE_S3_BUCKET") or os.getenv("AWS_BUCKET_NAME")
+ARCHIVE_S3_PREFIX = os.getenv("ARCHIVE_S3_PREFIX", "message-archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 180))
+ARCHIVE_SEGMENT_CACHE_SIZE = int(os.getenv("ARCHIVE_SEGMENT_CACHE_SIZE", 32))
+
 # =========================================================
 #  Email / SMTP configuration
 # =========================================================
@@ -133,6 +203,38 @@ def verify_access_token(token: str):
 def setup_constraints():
     db.cypher_query("CREATE CONSTRAINT IF NOT EXISTS FOR (u:User) REQUIRE u.email IS UNIQUE")
     db.cypher_query("CREATE CONSTRAINT IF NOT EXISTS FOR (u:User) REQUIRE u.user_id IS UNIQUE")
+    db.cypher_query(
+        "CREATE CONSTRAINT IF NOT EXISTS FOR (b:MessageBucket) REQUIRE b.bucket_id IS UNIQUE"
+    )
+    db.cypher_query(
+        "CREATE INDEX message_bucket_last_at IF NOT EXISTS FOR (b:MessageBucket) ON (b.last_at)"
+    )
+    db.cypher_query(
+        "CREATE CONSTRAINT IF NOT EXISTS FOR (s:MessageSegment) REQUIRE s.segment_id IS UNIQUE"
+    )
+    db.cypher_query("CREATE INDEX message_timestamp IF NOT EXISTS FOR (m:Message) ON (m.timestamp)")
+    db.cypher_query(
+        "CREATE INDEX message_conversation_seq IF NOT EXISTS FOR (m:Message) ON (m.conversation_id, m.seq)"
+    )
+    db.cypher_query(
+        "CREATE INDEX message_conversation_change IF NOT EXISTS "
+        "FOR (m:Message) ON (m.conversation_id, m.change_seq)"
+    )
+    db.cypher_query(
+        "CREATE INDEX tombstone_conversation_change IF NOT EXISTS "
+        "FOR (t:MessageTombstone) ON (t.conversation_id, t.change_seq)"
+    )
+    db.cypher_query(
+        "CREATE INDEX tombstone_conversation_seq IF NOT EXISTS "
+        "FOR (t:MessageTombstone) ON (t.conversation_id, t.seq)"
+    )
+    # conversation_id is indexed alongside content so searches can be scoped
+    # to the caller's conversations inside Lucene (replaces message_content)
+    db.cypher_query("DROP INDEX message_content IF EXISTS")
+    db.cypher_query(
+        "CREATE FULLTEXT INDEX message_search IF NOT EXISTS "
+        "FOR (m:Message) ON EACH [m.content, m.conversation_id]"
+    )
 
 def reconnect_to_db():
     try:
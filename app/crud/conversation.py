@@ -1,7 +1,19 @@
 from uuid import uuid4
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional
+from neomodel import db
 from app.config import neo4j_conn
-from app.models import Conversation, User
+from app.models import Conversation, User, Message
+from app.models.user import MembershipRel
+
+# Unread messages for membership `r` of conversation `c`: seq numbers above the
+# read pointer, minus the ones whose message was deleted since (tombstones).
+_UNREAD = """
+coalesce(c.message_seq, 0) - coalesce(r.last_read_seq, 0) - COUNT {
+    MATCH (t:MessageTombstone {conversation_id: c.conversation_id})
+    WHERE t.seq > coalesce(r.last_read_seq, 0)
+}
+"""
 
 
 class ConversationCRUD:
@@ -32,12 +44,24 @@ class ConversationCRUD:
     # Add / remove members
     # ------------------------------------------------------------------
     def add_member(self, conversation_id: str, user_id: str) -> Optional[Conversation]:
-        convo = Conversation.nodes.get_or_none(conversation_id=conversation_id)
-        user = User.nodes.get_or_none(user_id=user_id)
-        if not convo or not user:
+        """
+        Add a user to a conversation (idempotent). A new member's read pointer
+        starts at the latest message, so the existing history isn't unread.
+        """
+        results, _ = db.cypher_query(
+            """
+            MATCH (c:Conversation {conversation_id: $conversation_id})
+            MATCH (u:User {user_id: $user_id})
+            MERGE (u)-[r:MEMBER_OF]->(c)
+            ON CREATE SET r.last_read_seq = coalesce(c.message_seq, 0),
+                          r.last_read_at = c.last_message_at
+            RETURN c
+            """,
+            {"conversation_id": conversation_id, "user_id": user_id},
+        )
+        if not results:
             return None
-        user.member_of.connect(convo)
-        return convo
+        return Conversation.inflate(results[0][0])
 
     def remove_member(self, conversation_id: str, user_id: str) -> Optional[Conversation]:
         convo = Conversation.nodes.get_or_none(conversation_id=conversation_id)
@@ -47,6 +71,33 @@ class ConversationCRUD:
         user.member_of.disconnect(convo)
         return convo
 
+    def get_conversation_ids(self, user_id: str) -> List[str]:
+        """ids of every conversation the user is a member of (one query)."""
+        results, _ = db.cypher_query(
+            "MATCH (:User {user_id: $user_id})-[:MEMBER_OF]->(c:Conversation) RETURN c.conversation_id",
+            {"user_id": user_id},
+        )
+        return [row[0] for row in results]
+
+    def get_member_ids(self, conversation_id: str) -> List[str]:
+        """user_ids of every member of the conversation (one query)."""
+        results, _ = db.cypher_query(
+            "MATCH (u:User)-[:MEMBER_OF]->(:Conversation {conversation_id: $conversation_id}) RETURN u.user_id",
+            {"conversation_id": conversation_id},
+        )
+        return [row[0] for row in results]
+
+    def get_member(self, conversation_id: str, user_id: str) -> Optional[User]:
+        """Return the user if they are a member of the conversation (one query), else None."""
+        results, _ = db.cypher_query(
+            """
+            MATCH (u:User {user_id: $user_id})-[:MEMBER_OF]->(:Conversation {conversation_id: $conversation_id})
+            RETURN u
+            """,
+            {"user_id": user_id, "conversation_id": conversation_id},
+        )
+        return User.inflate(results[0][0]) if results else None
+
     # ------------------------------------------------------------------
     # Get / update / delete
     # ------------------------------------------------------------------
@@ -60,8 +111,13 @@ class ConversationCRUD:
         if not convo:
             return None
         if is_group is not None:
+            # Targeted SET: a full save() would write back stale message_seq /
+            # change_seq counters and race with concurrent sends.
+            db.cypher_query(
+                "MATCH (c:Conversation {conversation_id: $cid}) SET c.is_group = $is_group",
+                {"cid": conversation_id, "is_group": is_group},
+            )
             convo.is_group = is_group
-        convo.save()
         return convo
 
     def delete_conversation(self, conversation_id: str) -> bool:
@@ -71,18 +127,93 @@ class ConversationCRUD:
         convo.delete()
         return True
     
-        # ------------------------------------------------------------------
-    # List conversations for a user
     # ------------------------------------------------------------------
-    def list_user_conversations(self, user_id: str) -> List[Conversation]:
+    # List conversations for a user (inbox)
+    # ------------------------------------------------------------------
+    def list_user_conversations(self, user_id: str) -> List[Dict]:
         """
-        Return all conversations that include the given user as a member.
+        Return the user's inbox in one query: every conversation they belong to
+        with its members, last message (+ sender), the caller's read pointer and
+        unread count, newest activity first.
         """
-        user = User.nodes.get_or_none(user_id=user_id)
-        if not user:
-            return []
-        # Retrieve through the relationship defined in User model (member_of)
-        return list(user.member_of.all())
+        query = """
+        MATCH (:User {user_id: $user_id})-[r:MEMBER_OF]->(c:Conversation)
+        OPTIONAL MATCH (lm:Message {message_id: c.last_message_id})
+        OPTIONAL MATCH (lm)<-[:SENT]-(ls:User)
+        RETURN c, r, lm, ls,
+               COLLECT { MATCH (c)<-[:MEMBER_OF]-(u:User) RETURN u } AS members,
+               """ + _UNREAD + """ AS unread
+        ORDER BY c.last_message_at IS NULL, c.last_message_at DESC
+        """
+        results, _ = db.cypher_query(query, {"user_id": user_id})
+        inbox: List[Dict] = []
+        for c, r, lm, ls, members, unread in results:
+            read = MembershipRel.inflate(r)
+            inbox.append({
+                "conversation": Conversation.inflate(c),
+                "members": [User.inflate(u) for u in members],
+                "last_message": Message.inflate(lm) if lm else None,
+                "last_sender": User.inflate(ls) if ls else None,
+                "last_read_at": read.last_read_at,
+                "last_read_seq": read.last_read_seq,
+                "unread_count": max(unread, 0),
+            })
+        return inbox
+
+    def refresh_last_message(self, conversation_id: str) -> None:
+        """Recompute the denormalized last-message pointer (after deletes / for backfill)."""
+        query = """
+        MATCH (c:Conversation {conversation_id: $conversation_id})
+        OPTIONAL MATCH (m:Message {conversation_id: $conversation_id})
+        WITH c, m ORDER BY m.seq DESC LIMIT 1
+        SET c.last_message_id = m.message_id, c.last_message_at = m.timestamp
+        """
+        db.cypher_query(query, {"conversation_id": conversation_id})
 
+    # ------------------------------------------------------------------
+    # Read pointers / unread counts
+    # ------------------------------------------------------------------
+    def mark_read(
+        self,
+        conversation_id: str,
+        user_id: str,
+        message_id: Optional[str] = None,
+    ) -> Optional[Dict]:
+        """
+        Move the member's read pointer up to `message_id` (or to the newest
+        message). The pointer never moves backwards. Returns None if the user is
+        not a member or the message is not in this conversation.
+        Unread count: conversation.message_seq - last_read_seq, less the
+        messages deleted above the pointer (indexed tombstone count).
+        """
+        now = MembershipRel.deflate({"last_read_at": datetime.utcnow()})["last_read_at"]
+        query = """
+        MATCH (:User {user_id: $user_id})-[r:MEMBER_OF]->(c:Conversation {conversation_id: $conversation_id})
+        OPTIONAL MATCH (target:Message {message_id: $message_id, conversation_id: $conversation_id})
+        WITH r, c,
+             CASE WHEN $message_id IS NULL THEN coalesce(c.message_seq, 0) ELSE target.seq END AS seq,
+             CASE WHEN $message_id IS NULL THEN $now ELSE target.timestamp END AS ts
+        WHERE seq IS NOT NULL
+        FOREACH (_ IN CASE WHEN seq > coalesce(r.last_read_seq, 0) THEN [1] ELSE [] END |
+            SET r.last_read_seq = seq, r.last_read_at = ts
+        )
+        RETURN r, """ + _UNREAD + """ AS unread
+        """
+        results, _ = db.cypher_query(query, {
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "now": now,
+        })
+        if not results:
+            return None
+        rel, unread = results[0]
+        read = MembershipRel.inflate(rel)
+        return {
+            "conversation_id": conversation_id,
+            "last_read_at": read.last_read_at,
+            "last_read_seq": read.last_read_seq,
+            "unread_count": max(unread, 0),
+        }
 
 conversation_crud = ConversationCRUD(neo4j_conn)
\ No newline at end of file
@@ -1,9 +1,64 @@
+import html
+import re
 from uuid import uuid4
 from datetime import datetime
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
-from app.config import neo4j_conn
-from app.models import Message, User, Conversation, File
+from neomodel import db
+
+from app.config import neo4j_conn, MESSAGE_BUCKET_SIZE
+from app.models import (
+    Message, MessageBucket, MessageSegment, MessageTombstone, User, Conversation, File
+)
+from app.schemas.message import MessageResponse, MessageSearchHit, MessageSyncResponse
+from app.schemas.file import FileResponse
+from app.services import segment_store
+
+# Inside a quoted Lucene phrase only these need escaping; quoting every term
+# also keeps words like AND / OR / NOT from being read as operators.
+_LUCENE_QUOTED_SPECIAL = re.compile(r'(["\\])')
+# Above this many conversations the Lucene query isn't narrowed to the user's
+# conversations (clause limit); the Cypher membership filter still applies.
+MAX_SEARCH_CONVERSATIONS = 500
+SNIPPET_RADIUS = 60  # characters of context on each side of the first hit
+
+# Tail for queries that bind `m`: load sender and attachments alongside it
+_HYDRATE = """
+OPTIONAL MATCH (m)<-[:SENT]-(u:User)
+OPTIONAL MATCH (m)-[:ATTACHED_TO]->(f:File)
+WITH m, u, collect(f) AS files
+RETURN m, u, files
+"""
+
+
+def _search_terms(query: str) -> List[str]:
+    return [t for t in query.split() if t.strip()]
+
+
+def _lucene_phrase(value: str) -> str:
+    return '"' + _LUCENE_QUOTED_SPECIAL.sub(r"\\\1", value) + '"'
+
+
+def _highlight(content: str, terms: List[str]) -> str:
+    """Cut a window around the first matching term and wrap all matches in <mark>."""
+    if not content:
+        return ""
+    pattern = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - SNIPPET_RADIUS) if first else 0
+    end = min(len(content), (first.end() if first else 0) + SNIPPET_RADIUS)
+
+    window = content[start:end]
+    parts, last = [], 0
+    for m in pattern.finditer(window):
+        parts.append(html.escape(window[last:m.start()]))
+        parts.append(f"<mark>{html.escape(m.group(0))}</mark>")
+        last = m.end()
+    parts.append(html.escape(window[last:]))
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    return prefix + "".join(parts) + suffix
 
 
 class MessageCRUD:
@@ -19,38 +74,259 @@ class MessageCRUD:
         conversation_id: str,
         content: Optional[str] = None,
         file_ids: Optional[List[str]] = None,
-    ) -> Optional[Message]:
-        """Create a message and attach any provided files."""
-        sender = User.nodes.get_or_none(user_id=sender_id)
-        conversation = Conversation.nodes.get_or_none(conversation_id=conversation_id)
-        if not sender or not conversation:
+        client_message_id: Optional[str] = None,
+    ) -> Optional[MessageResponse]:
+        """
+        Create a message and attach any provided files in one write transaction.
+        Returns the fully hydrated response, or None if sender/conversation is missing.
+        """
+        created = Message.create_with_files(
+            message_id=str(uuid4()),
+            content=content or "",
+            sender_id=sender_id,
+            conversation_id=conversation_id,
+            file_ids=file_ids,
+            client_message_id=client_message_id,
+        )
+        if not created:
             return None
 
-        file_nodes: list[File] = []
-        if file_ids:
-            for fid in file_ids:
-                file_node = File.nodes.get_or_none(file_id=fid)
-                if file_node:
-                    file_nodes.append(file_node)
+        msg, sender, files = created
+        return self.build_response(msg, sender, files, conversation_id)
 
-        msg = Message.create_with_files(
-            message_id=str(uuid4()),
-            content=content or "",
-            sender_node=sender,
-            conversation_node=conversation,
-            file_nodes=file_nodes,
+    # ------------------------------------------------------------------
+    # 🧾  Serialize a message node into the API response shape
+    # ------------------------------------------------------------------
+    @staticmethod
+    def build_response(
+        message: Message,
+        sender: Optional[User],
+        files: List[File],
+        conversation_id: Optional[str],
+    ) -> MessageResponse:
+        """Build a MessageResponse from already loaded nodes (no extra queries)."""
+        return MessageResponse(
+            message_id=message.message_id,
+            content=message.content,
+            timestamp=message.timestamp,
+            sender_id=getattr(sender, "user_id", None),
+            username=getattr(sender, "username", None),
+            user_profile_url=getattr(sender, "profile_photo", None),
+            conversation_id=conversation_id,
+            files=[
+                FileResponse(
+                    file_id=f.file_id,
+                    url=f.url,
+                    file_type=f.file_type,
+                    size=f.size,
+                )
+                for f in files
+            ],
+            seq=message.seq,
+            edited_at=message.edited_at,
+            client_message_id=message.client_message_id,
         )
-        return msg
 
     # ------------------------------------------------------------------
     # 💬  Retrieve messages for conversation
     # ------------------------------------------------------------------
-    def get_messages_in_conversation(self, conversation_id: str) -> List[Message]:
-        """Return all messages in a conversation ordered by timestamp."""
-        conversation = Conversation.nodes.get_or_none(conversation_id=conversation_id)
-        if not conversation:
+    def get_messages_in_conversation(
+        self, conversation_id: str, after: Optional[datetime] = None
+    ) -> List[MessageResponse]:
+        """
+        Return the whole history of a conversation in send (seq) order, hydrated,
+        archived segments first. With `after` (e.g. the member's read pointer),
+        only newer messages.
+        """
+        archived = [
+            m for m in self._read_segments(conversation_id)
+            if after is None or m.timestamp > after
+        ]
+        query = """
+        MATCH (:Conversation {conversation_id: $conversation_id})-[:HAS_BUCKET]->(:MessageBucket)
+              <-[:IN_BUCKET]-(m:Message)
+        WHERE $after IS NULL OR m.timestamp > $after
+        """ + _HYDRATE + """
+        ORDER BY m.seq
+        """
+        results, _ = db.cypher_query(query, {
+            "conversation_id": conversation_id,
+            "after": Message.timestamp.deflate(after) if after else None,
+        })
+        return archived + self._hydrate_rows(results, conversation_id)
+
+    def get_message_page(
+        self,
+        conversation_id: str,
+        limit: int,
+        before_seq: Optional[int] = None,
+    ) -> List[MessageResponse]:
+        """
+        Return up to `limit` messages with seq < before_seq (default: newest),
+        oldest first. Only the buckets covering the requested seq range are
+        read; the range is widened downwards only if deletions left gaps.
+        Ranges that were archived are read from their segments transparently.
+        """
+        if before_seq is None:
+            conversation = Conversation.nodes.get_or_none(conversation_id=conversation_id)
+            if not conversation:
+                return []
+            hi = conversation.message_seq or 0
+        else:
+            hi = before_seq - 1
+
+        query = """
+        MATCH (b:MessageBucket)<-[:IN_BUCKET]-(m:Message)
+        WHERE b.bucket_id IN $bucket_ids AND $lo <= m.seq <= $hi
+        """ + _HYDRATE + """
+        ORDER BY m.seq DESC
+        """
+        page: List[MessageResponse] = []
+        while hi >= 1 and len(page) < limit:
+            lo = max(1, hi - (limit - len(page)) + 1)
+            first_bucket = (lo - 1) // MESSAGE_BUCKET_SIZE
+            last_bucket = (hi - 1) // MESSAGE_BUCKET_SIZE
+            bucket_ids = [
+                f"{conversation_id}:{index}" for index in range(first_bucket, last_bucket + 1)
+            ]
+            results, _ = db.cypher_query(query, {"bucket_ids": bucket_ids, "lo": lo, "hi": hi})
+            found = self._hydrate_rows(results, conversation_id)
+            if len(found) < hi - lo + 1:
+                # Gaps: deleted messages, or buckets that now live in cold storage
+                found += [
+                    m for m in self._read_segments(conversation_id, bucket_ids)
+                    if lo <= m.seq <= hi
+                ]
+                found.sort(key=lambda m: m.seq, reverse=True)
+            page.extend(found)
+            hi = lo - 1
+
+        page.reverse()
+        return page[-limit:]
+
+    def get_recent_messages(self, conversation_id: str, limit: int) -> List[MessageResponse]:
+        """Return the newest `limit` messages (oldest first)."""
+        return self.get_message_page(conversation_id, limit)
+
+    @staticmethod
+    def _read_segments(
+        conversation_id: str, segment_ids: Optional[List[str]] = None
+    ) -> List[MessageResponse]:
+        """Messages from archived segments (all, or only `segment_ids`), seq order."""
+        query = """
+        MATCH (s:MessageSegment {conversation_id: $conversation_id})
+        WHERE $segment_ids IS NULL OR s.segment_id IN $segment_ids
+        RETURN s.storage_key ORDER BY s.index
+        """
+        results, _ = db.cypher_query(query, {
+            "conversation_id": conversation_id,
+            "segment_ids": segment_ids,
+        })
+        messages: List[MessageResponse] = []
+        for (key,) in results:
+            messages.extend(segment_store.read_segment(key))
+        return messages
+
+    def _hydrate_rows(self, rows, conversation_id: Optional[str]) -> List[MessageResponse]:
+        """Turn (m, u, files) rows from a _HYDRATE query into responses."""
+        return [
+            self.build_response(
+                Message.inflate(m),
+                User.inflate(u) if u else None,
+                [File.inflate(f) for f in files],
+                conversation_id,
+            )
+            for m, u, files in rows
+        ]
+
+    # ------------------------------------------------------------------
+    # 🔎  Full-text search across the user's conversations
+    # ------------------------------------------------------------------
+    def search_messages(
+        self,
+        user_id: str,
+        query: str,
+        conversation_id: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 20,
+    ) -> List[MessageSearchHit]:
+        """
+        Search message content through the `message_search` full-text index.
+        The Lucene query itself is limited to the user's conversations (the
+        index also covers conversation_id), so common words don't score hits
+        from the whole database. Best match first.
+        """
+        terms = _search_terms(query)
+        if not terms:
+            return []
+        conversation_ids, _ = db.cypher_query("""
+        MATCH (:User {user_id: $user_id})-[:MEMBER_OF]->(c:Conversation)
+        WHERE $conversation_id IS NULL OR c.conversation_id = $conversation_id
+        RETURN c.conversation_id
+        """, {"user_id": user_id, "conversation_id": conversation_id})
+        if not conversation_ids:
             return []
-        return list(conversation.messages.order_by("timestamp"))
+
+        lucene = " AND ".join(f"content:{_lucene_phrase(t)}" for t in terms)
+        if len(conversation_ids) <= MAX_SEARCH_CONVERSATIONS:
+            scope = " OR ".join(_lucene_phrase(cid) for (cid,) in conversation_ids)
+            lucene = f"({lucene}) AND conversation_id:({scope})"
+
+        cypher = """
+        CALL db.index.fulltext.queryNodes('message_search', $lucene) YIELD node, score
+        MATCH (c:Conversation {conversation_id: node.conversation_id})<-[:MEMBER_OF]-(:User {user_id: $user_id})
+        WHERE $conversation_id IS NULL OR c.conversation_id = $conversation_id
+        WITH node, score, c ORDER BY score DESC, node.timestamp DESC SKIP $skip LIMIT $limit
+        OPTIONAL MATCH (node)<-[:SENT]-(u:User)
+        OPTIONAL MATCH (node)-[:ATTACHED_TO]->(f:File)
+        WITH node, score, c, u, collect(f) AS files
+        RETURN node, u, files, c.conversation_id, score
+        ORDER BY score DESC, node.timestamp DESC
+        """
+        results, _ = db.cypher_query(cypher, {
+            "lucene": lucene,
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "skip": skip,
+            "limit": limit,
+        })
+
+        hits: List[MessageSearchHit] = []
+        for m, u, files, cid, score in results:
+            msg = Message.inflate(m)
+            hits.append(
+                MessageSearchHit(
+                    message=self.build_response(
+                        msg,
+                        User.inflate(u) if u else None,
+                        [File.inflate(f) for f in files],
+                        cid,
+                    ),
+                    score=score,
+                    snippet=_highlight(msg.content, terms),
+                )
+            )
+        return hits
+
+    def get_message_response(self, message_id: str) -> Optional[MessageResponse]:
+        """Fetch one message hydrated with sender and files in a single query."""
+        query = """
+        MATCH (m:Message {message_id: $message_id})
+        OPTIONAL MATCH (m)<-[:SENT]-(u:User)
+        OPTIONAL MATCH (m)-[:ATTACHED_TO]->(f:File)
+        RETURN m, u, collect(f) AS files
+        """
+        results, _ = db.cypher_query(query, {"message_id": message_id})
+        if not results:
+            return None
+        m, u, files = results[0]
+        msg = Message.inflate(m)
+        return self.build_response(
+            msg,
+            User.inflate(u) if u else None,
+            [File.inflate(f) for f in files],
+            msg.conversation_id,
+        )
 
     # ------------------------------------------------------------------
     # 🔍  Get single message by ID
@@ -86,8 +362,9 @@ class MessageCRUD:
                 if file_node:
                     message.attachments.connect(file_node)
 
-        message.timestamp = datetime.utcnow()
+        message.edited_at = datetime.utcnow()
         message.save()
+        self._record_change(message)
         return message
 
     # ------------------------------------------------------------------
@@ -110,7 +387,11 @@ class MessageCRUD:
             return None
 
         if delete_content and delete_files:
-            message.delete()
+            convo = Conversation.nodes.get_or_none(conversation_id=message.conversation_id)
+            self._delete_with_tombstone(message_id)
+            if convo and convo.last_message_id == message_id:
+                from app.crud.conversation import conversation_crud
+                conversation_crud.refresh_last_message(convo.conversation_id)
             return None
 
         if delete_content:
@@ -120,9 +401,226 @@ class MessageCRUD:
             for f in list(message.attachments):
                 message.attachments.disconnect(f)
 
-        message.timestamp = datetime.utcnow()
+        message.edited_at = datetime.utcnow()
         message.save()
+        self._record_change(message)
         return message
 
+    # ------------------------------------------------------------------
+    # 🧮  Change log (edits / deletes) for delta sync
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _record_change(message: Message) -> None:
+        """Stamp an edited message with the conversation's next change_seq."""
+        query = """
+        MATCH (m:Message {message_id: $message_id})
+        MATCH (c:Conversation {conversation_id: m.conversation_id})
+        SET c.change_seq = coalesce(c.change_seq, 0) + 1
+        WITH m, c
+        SET m.change_seq = c.change_seq
+        RETURN m.change_seq
+        """
+        results, _ = db.cypher_query(query, {"message_id": message.message_id})
+        if results:
+            message.change_seq = results[0][0]
+
+    @staticmethod
+    def _delete_with_tombstone(message_id: str) -> None:
+        """Delete a message and leave a MessageTombstone at the next change_seq."""
+        query = """
+        MATCH (m:Message {message_id: $message_id})
+        MATCH (c:Conversation {conversation_id: m.conversation_id})
+        OPTIONAL MATCH (m)-[:IN_BUCKET]->(b:MessageBucket)
+        SET c.change_seq = coalesce(c.change_seq, 0) + 1,
+            b.message_count = b.message_count - 1
+        WITH m, c
+        CREATE (:MessageTombstone {
+            message_id: m.message_id,
+            conversation_id: c.conversation_id,
+            seq: m.seq,
+            change_seq: c.change_seq,
+            deleted_at: $now
+        })
+        DETACH DELETE m
+        """
+        now = MessageTombstone.deleted_at.deflate(datetime.utcnow())
+        db.cypher_query(query, {"message_id": message_id, "now": now})
+
+    # ------------------------------------------------------------------
+    # 📦  Streaming iteration (exports)
+    # ------------------------------------------------------------------
+    def iter_messages(self, conversation_id: str, batch_size: int = 500) -> Iterator[MessageResponse]:
+        """
+        Yield the whole history in seq order with bounded memory: archived
+        segments one at a time, then live messages in keyset-paginated
+        batches over the (conversation_id, seq) index.
+        """
+        segments, _ = db.cypher_query("""
+        MATCH (s:MessageSegment {conversation_id: $conversation_id})
+        RETURN s.storage_key ORDER BY s.index
+        """, {"conversation_id": conversation_id})
+        for (key,) in segments:
+            yield from segment_store.read_segment(key)
+
+        query = """
+        MATCH (m:Message {conversation_id: $conversation_id})
+        WHERE m.seq > $after
+        WITH m ORDER BY m.seq LIMIT $batch_size
+        """ + _HYDRATE + """
+        ORDER BY m.seq
+        """
+        after = 0
+        while True:
+            results, _ = db.cypher_query(query, {
+                "conversation_id": conversation_id,
+                "after": after,
+                "batch_size": batch_size,
+            })
+            batch = self._hydrate_rows(results, conversation_id)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = batch[-1].seq
+
+    # ------------------------------------------------------------------
+    # 🧊  Archival of old history into cold-storage segments
+    # ------------------------------------------------------------------
+    def find_archivable_buckets(self, older_than: datetime, limit: int = 100) -> List[str]:
+        """
+        Sealed buckets (every seq slot already assigned) whose newest message
+        is older than `older_than`. Open buckets are never archived, so a
+        segment never needs to be appended to.
+        """
+        query = """
+        MATCH (b:MessageBucket) WHERE b.last_at < $cutoff
+        MATCH (c:Conversation {conversation_id: b.conversation_id})
+        WHERE c.message_seq >= b.last_seq
+        RETURN b.bucket_id ORDER BY b.last_at LIMIT $limit
+        """
+        results, _ = db.cypher_query(query, {
+            "cutoff": MessageBucket.last_at.deflate(older_than),
+            "limit": limit,
+        })
+        return [row[0] for row in results]
+
+    def archive_bucket(self, bucket_id: str) -> Optional[MessageSegment]:
+        """
+        Write one bucket to a compressed segment, then swap the bucket and its
+        messages for a MessageSegment index node. The swap only commits if the
+        bucket is unchanged since it was read (no edits/deletes in between);
+        otherwise None is returned and the bucket stays live for the next run.
+        """
+        bucket = MessageBucket.nodes.get_or_none(bucket_id=bucket_id)
+        if not bucket:
+            return None
+
+        results, _ = db.cypher_query("""
+        MATCH (b:MessageBucket {bucket_id: $bucket_id})<-[:IN_BUCKET]-(m:Message)
+        """ + _HYDRATE + """
+        ORDER BY m.seq
+        """, {"bucket_id": bucket_id})
+        messages = self._hydrate_rows(results, bucket.conversation_id)
+        max_change = max((m.get("change_seq") or 0 for m, _, _ in results), default=0)
+
+        key = segment_store.new_segment_key(bucket.conversation_id, bucket.index)
+        size = segment_store.write_segment(key, messages)
+
+        props = MessageSegment.deflate({
+            "segment_id": bucket.bucket_id,
+            "conversation_id": bucket.conversation_id,
+            "index": bucket.index,
+            "first_seq": bucket.first_seq,
+            "last_seq": bucket.last_seq,
+            "message_count": len(messages),
+            "first_at": bucket.first_at,
+            "last_at": bucket.last_at,
+            "storage_key": key,
+            "size_bytes": size,
+            "archived_at": datetime.utcnow(),
+        }, skip_empty=True)
+        swapped, _ = db.cypher_query("""
+        MATCH (b:MessageBucket {bucket_id: $bucket_id})
+        OPTIONAL MATCH (b)<-[:IN_BUCKET]-(m:Message)
+        WITH b, collect(m) AS msgs
+        WHERE size(msgs) = $count AND all(x IN msgs WHERE coalesce(x.change_seq, 0) <= $max_change)
+        MATCH (c:Conversation {conversation_id: b.conversation_id})
+        CREATE (c)-[:HAS_SEGMENT]->(s:MessageSegment $props)
+        FOREACH (x IN msgs | DETACH DELETE x)
+        DETACH DELETE b
+        RETURN s
+        """, {
+            "bucket_id": bucket_id,
+            "count": len(messages),
+            "max_change": max_change,
+            "props": props,
+        })
+        if not swapped:
+            return None
+        return MessageSegment.inflate(swapped[0][0])
+
+    # ------------------------------------------------------------------
+    # 🔄  Delta sync
+    # ------------------------------------------------------------------
+    def get_changes(
+        self,
+        conversation_id: str,
+        since: int = 0,
+        since_change: int = 0,
+        limit: int = 200,
+    ) -> Optional[MessageSyncResponse]:
+        """
+        Return what changed after the client's cursors:
+          - messages with seq > since (at most `limit`, in seq order)
+          - edits / deletions with change_seq > since_change of messages the
+            client already has (seq <= since)
+        Cost is proportional to the number of changes, not the history size.
+        """
+        conversation = Conversation.nodes.get_or_none(conversation_id=conversation_id)
+        if not conversation:
+            return None
+        # Snapshot the counters so every query below sees the same bounds
+        last_seq = conversation.message_seq or 0
+        last_change_seq = conversation.change_seq or 0
+
+        params = {
+            "conversation_id": conversation_id,
+            "since": since,
+            "since_change": since_change,
+            "last_seq": last_seq,
+            "last_change_seq": last_change_seq,
+            "limit": limit + 1,
+        }
+        hydrate = _HYDRATE + "ORDER BY m.seq"
+        new_rows, _ = db.cypher_query("""
+        MATCH (m:Message {conversation_id: $conversation_id})
+        WHERE $since < m.seq <= $last_seq
+        WITH m ORDER BY m.seq LIMIT $limit
+        """ + hydrate, params)
+        updated_rows, _ = db.cypher_query("""
+        MATCH (m:Message {conversation_id: $conversation_id})
+        WHERE $since_change < m.change_seq <= $last_change_seq AND m.seq <= $since
+        WITH m
+        """ + hydrate, params)
+        deleted_rows, _ = db.cypher_query("""
+        MATCH (t:MessageTombstone {conversation_id: $conversation_id})
+        WHERE $since_change < t.change_seq <= $last_change_seq AND t.seq <= $since
+        RETURN t.message_id ORDER BY t.change_seq
+        """, params)
+
+        messages = self._hydrate_rows(new_rows, conversation_id)
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[:limit]
+
+        return MessageSyncResponse(
+            conversation_id=conversation_id,
+            messages=messages,
+            updated=self._hydrate_rows(updated_rows, conversation_id),
+            deleted=[row[0] for row in deleted_rows],
+            last_seq=messages[-1].seq if has_more else last_seq,
+            last_change_seq=last_change_seq,
+            has_more=has_more,
+        )
+
 # ✅  Instantiate singleton CRUD object
 message_crud = MessageCRUD(neo4j_conn)
\ No newline at end of file
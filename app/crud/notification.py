@@ -3,6 +3,8 @@ from neomodel import db
 from app.models.notification import Notification
 from app.models.user import User
 from app.models.post import Post
+from app.schemas.notification import NotificationResponse
+from app.services.ws_manager import manager as ws_manager
 
 
 class NotificationCRUD:
@@ -41,6 +43,15 @@ class NotificationCRUD:
         except Exception as e:
             print(f"[⚠️] Notification relationship creation failed: {e}")
 
+        # Push to the receiver's live /ws sockets (no-op if they aren't connected)
+        try:
+            payload = NotificationResponse.model_validate(notif).model_dump(mode="json")
+            ws_manager.send_to_user_threadsafe(
+                receiver_id, {"type": "notification", "notification": payload}, kind="notification"
+            )
+        except Exception as e:
+            print(f"[⚠️] Notification push failed: {e}")
+
         return notif
 
     @staticmethod
@@ -2,9 +2,11 @@ from fastapi import FastAPI
 from neo4j.exceptions import AuthError, ServiceUnavailable
 from app.config import (
     driver,
-    Redis, redis_client,
+    Redis, BlockingConnectionPool, redis_client,
     REDIS_HOST, REDIS_PORT, REDIS_USERNAME, REDIS_PASSWORD, REDIS_SSL,
+    REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT,
 )
+from redis.asyncio.connection import Connection, SSLConnection
 from app.routers import (
     user, conversation, message, file,
     post, reaction, comment,
@@ -14,6 +16,8 @@ from app.routers import email_health_http
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import notification
 from app.routers import ws_chat
+from app.services.ws_manager import manager as ws_manager
+from app.services import db_executor
 
 
 
@@ -69,23 +73,35 @@ def startup_db_check():
 @app.on_event("startup")
 async def connect_redis():
     from app import config
-    config.redis_client = Redis(
+    config.redis_pool = BlockingConnectionPool(
         host=REDIS_HOST, port=REDIS_PORT,
         username=REDIS_USERNAME, password=REDIS_PASSWORD,
-        ssl=REDIS_SSL,
+        connection_class=SSLConnection if REDIS_SSL else Connection,
+        max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
         decode_responses=True,
     )
+    config.redis_client = Redis(connection_pool=config.redis_pool)
     try:
         pong = await config.redis_client.ping()
         print(f"[✅] Redis connected (PING → {pong})")
     except Exception as e:
         print(f"[❌] Redis connection failed: {e}")
+        await ws_manager.start(None)
+        return
+    await ws_manager.start(config.redis_client)
 
 @app.on_event("shutdown")
 async def shutdown_connections():
     from app import config
+    # Under app.server the drain already ran before uvicorn closed the sockets;
+    # this catches anything left when started with plain `uvicorn app.main:app`.
+    await ws_manager.drain()
+    await ws_manager.stop()
     if config.redis_client:
         await config.redis_client.close()
-        print("[ℹ️] Redis connection closed.")
+    if config.redis_pool:
+        await config.redis_pool.disconnect()
+        print("[ℹ️] Redis connection pool closed.")
+    db_executor.shutdown()
     driver.close()
     print("[ℹ️] Official driver connection closed.")
\ No newline at end of file
@@ -1,9 +1,9 @@
 from .user import User
-from .message import Message
+from .message import Message, MessageBucket, MessageSegment, MessageTombstone
 from .conversation import Conversation
 from .file import File
 from .post import Post
 from .reaction import Reaction    # 🆕
 from .comment import Comment    
 
-__all__ = ["User", "Post", "Message", "Conversation", "File", "Reaction", "Comment"]  # 🆕
+__all__ = ["User", "Post", "Message", "MessageBucket", "MessageSegment", "MessageTombstone", "Conversation", "File", "Reaction", "Comment"]  # 🆕
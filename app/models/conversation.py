@@ -1,12 +1,23 @@
-from neomodel import StructuredNode, StringProperty, BooleanProperty, RelationshipFrom, RelationshipTo
+from neomodel import StructuredNode, StringProperty, BooleanProperty, DateTimeProperty, IntegerProperty, RelationshipFrom, RelationshipTo
+from app.models.user import MembershipRel
 
 class Conversation(StructuredNode):
     """A message thread or group chat."""
     conversation_id = StringProperty(unique_index=True, required=True)
     is_group = BooleanProperty(required=True)
 
+    # Denormalized pointer to the newest message (kept by the send transaction)
+    last_message_id = StringProperty(required=False)
+    last_message_at = DateTimeProperty(required=False, index=True)
+
+    # Per-conversation counters: message_seq for sends, change_seq for edits/deletes
+    message_seq = IntegerProperty(default=0)
+    change_seq = IntegerProperty(default=0)
+
     # Users that are part of this conversation
-    members = RelationshipFrom("app.models.user.User", "MEMBER_OF")
+    members = RelationshipFrom("app.models.user.User", "MEMBER_OF", model=MembershipRel)
 
-    # Messages linked to this conversation
-    messages = RelationshipFrom("app.models.message.Message", "IN_CONVERSATION")
\ No newline at end of file
+    # Message history, sliced into fixed-size buckets (see MessageBucket)
+    buckets = RelationshipTo("app.models.message.MessageBucket", "HAS_BUCKET")
+    # Archived buckets (compressed segments in object storage)
+    segments = RelationshipTo("app.models.message.MessageSegment", "HAS_SEGMENT")
\ No newline at end of file
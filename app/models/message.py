@@ -1,44 +1,160 @@
 from neomodel import (
-    StructuredNode, StringProperty, DateTimeProperty,
-    RelationshipTo, RelationshipFrom
+    StructuredNode, StringProperty, DateTimeProperty, IntegerProperty,
+    RelationshipTo, RelationshipFrom, db
 )
 from datetime import datetime
-# in app/models/conversation.py
-messages = RelationshipFrom("app.models.message.Message", "IN_CONVERSATION")
+from app.config import MESSAGE_BUCKET_SIZE
+
+# Shared by the send transaction and the bucket migration. Expects `c`
+# (Conversation) and `seq` in scope; binds `b` (MessageBucket).
+BUCKET_MERGE = """
+MERGE (b:MessageBucket {bucket_id: c.conversation_id + ':' + toString((seq - 1) / $bucket_size)})
+ON CREATE SET b.conversation_id = c.conversation_id,
+              b.index = (seq - 1) / $bucket_size,
+              b.first_seq = ((seq - 1) / $bucket_size) * $bucket_size + 1,
+              b.last_seq = ((seq - 1) / $bucket_size + 1) * $bucket_size,
+              b.message_count = 0
+MERGE (c)-[:HAS_BUCKET]->(b)
+"""
+
+
+class MessageBucket(StructuredNode):
+    """
+    Fixed-size slice of a conversation's history: messages with
+    seq in [first_seq, last_seq]. Bucket n of a conversation holds
+    seq n*MESSAGE_BUCKET_SIZE+1 … (n+1)*MESSAGE_BUCKET_SIZE, so a page of
+    history maps directly to the few buckets it needs and no node ends up
+    with millions of relationships.
+    """
+    bucket_id = StringProperty(unique_index=True, required=True)   # "<conversation_id>:<index>"
+    conversation_id = StringProperty(index=True, required=True)
+    index = IntegerProperty(required=True)
+    first_seq = IntegerProperty(required=True)
+    last_seq = IntegerProperty(required=True)
+    message_count = IntegerProperty(default=0)
+    first_at = DateTimeProperty(required=False)
+    last_at = DateTimeProperty(required=False, index=True)
+
+    conversation = RelationshipFrom("app.models.conversation.Conversation", "HAS_BUCKET")
+    messages = RelationshipFrom("app.models.message.Message", "IN_BUCKET")
+
+
 class Message(StructuredNode):
     message_id = StringProperty(unique_index=True, required=True)
     content = StringProperty(required=True)
-    timestamp = DateTimeProperty(default_now=True)
+    timestamp = DateTimeProperty(default_now=True, index=True)
+
+    # Ordering / sync: `seq` is assigned once at send time (monotonic per conversation),
+    # `change_seq` is the conversation change-log position of the latest edit.
+    conversation_id = StringProperty(index=True)
+    seq = IntegerProperty(index=True)
+    change_seq = IntegerProperty(required=False)
+    edited_at = DateTimeProperty(required=False)
+
+    # Client-generated id used to dedupe retried sends
+    client_message_id = StringProperty(required=False)
 
     # Relationships
     sender = RelationshipFrom("app.models.user.User", "SENT")
-    in_conversation = RelationshipTo("app.models.conversation.Conversation", "IN_CONVERSATION")
+    bucket = RelationshipTo("app.models.message.MessageBucket", "IN_BUCKET")
     attachments = RelationshipTo("app.models.file.File", "ATTACHED_TO")
 
     @classmethod
     def create_with_files(cls, message_id: str, content: str,
-                          sender_node, conversation_node,
-                          file_nodes: list = None):
+                          sender_id: str, conversation_id: str,
+                          file_ids: list = None, client_message_id: str = None):
+        """
+        Convenience constructor: create a message and wire up sender, conversation bucket,
+        and files in a single write transaction (one round trip to Neo4j).
+        Incrementing the conversation's message_seq write-locks the conversation,
+        so sequence numbers are gap-free and ordered under concurrent sends.
+        The sender's read pointer and the conversation's last-message pointer
+        move to the new message.
+        Returns (message, sender, files) or None if the sender or conversation is missing.
+        - sender_id: user_id of the sending User
+        - conversation_id: conversation_id of the target Conversation
+        - file_ids: file_id values of existing File nodes (unknown ids are ignored)
+        - client_message_id: optional client-generated id, echoed back to the sender
         """
-        Convenience constructor: create a message and wire up sender, conversation, and files.
-        - sender_node: a User node (app.models.user.User)
-        - conversation_node: a Conversation node (app.models.conversation.Conversation)
-        - file_nodes: a list of File nodes (app.models.file.File)
+        from app.models.user import User
+        from app.models.file import File
+
+        props = cls.deflate({
+            "message_id": message_id,
+            "content": content,
+            "timestamp": datetime.utcnow(),
+            "client_message_id": client_message_id,
+        }, skip_empty=True)
+        query = """
+        MATCH (u:User {user_id: $sender_id})
+        MATCH (c:Conversation {conversation_id: $conversation_id})
+        OPTIONAL MATCH (u)-[r:MEMBER_OF]->(c)
+        SET c.message_seq = coalesce(c.message_seq, 0) + 1
+        WITH u, c, r, c.message_seq AS seq
+        """ + BUCKET_MERGE + """
+        CREATE (u)-[:SENT]->(m:Message $props)-[:IN_BUCKET]->(b)
+        SET b.message_count = b.message_count + 1,
+            b.first_at = coalesce(b.first_at, m.timestamp),
+            b.last_at = m.timestamp,
+            m.seq = seq,
+            m.conversation_id = c.conversation_id,
+            r.last_read_at = m.timestamp,
+            r.last_read_seq = seq,
+            c.last_message_id = m.message_id,
+            c.last_message_at = m.timestamp
+        WITH m, u
+        CALL {
+            WITH m
+            UNWIND $file_ids AS fid
+            MATCH (f:File {file_id: fid})
+            MERGE (m)-[:ATTACHED_TO]->(f)
+            RETURN collect(f) AS files
+        }
+        RETURN m, u, files
         """
-        # Create message
-        msg = cls(message_id=message_id, content=content, timestamp=datetime.utcnow()).save()
+        results, _ = db.cypher_query(query, {
+            "sender_id": sender_id,
+            "conversation_id": conversation_id,
+            "props": props,
+            "file_ids": list(file_ids or []),
+            "bucket_size": MESSAGE_BUCKET_SIZE,
+        })
+        if not results:
+            return None
+
+        m, u, files = results[0]
+        return cls.inflate(m), User.inflate(u), [File.inflate(f) for f in files]
+
 
-        # Connect sender
-        if sender_node:
-            sender_node.sent_messages.connect(msg)
+class MessageTombstone(StructuredNode):
+    """
+    Marker left behind by a fully deleted message so delta-sync clients
+    learn about the deletion. Looked up by (conversation_id, change_seq).
+    """
+    message_id = StringProperty(required=True)
+    conversation_id = StringProperty(required=True)
+    seq = IntegerProperty()
+    change_seq = IntegerProperty(required=True)
+    deleted_at = DateTimeProperty(default_now=True)
 
-        # Connect conversation
-        if conversation_node:
-            msg.in_conversation.connect(conversation_node)
 
-        # Attach files if provided
-        if file_nodes:
-            for f in file_nodes:
-                msg.attachments.connect(f)
+class MessageSegment(StructuredNode):
+    """
+    Index node for an archived bucket: its messages live in a compressed,
+    append-only segment object (see app.services.segment_store), not in Neo4j.
+    segment_id equals the bucket_id it replaced, so seq → segment is the same
+    arithmetic as seq → bucket.
+    """
+    segment_id = StringProperty(unique_index=True, required=True)
+    conversation_id = StringProperty(index=True, required=True)
+    index = IntegerProperty(required=True)
+    first_seq = IntegerProperty(required=True)
+    last_seq = IntegerProperty(required=True)
+    message_count = IntegerProperty(default=0)
+    first_at = DateTimeProperty(required=False)
+    last_at = DateTimeProperty(required=False)
+    storage_key = StringProperty(required=True)
+    size_bytes = IntegerProperty(default=0)
+    archived_at = DateTimeProperty(default_now=True)
 
-        return msg
\ No newline at end of file
+    conversation = RelationshipFrom("app.models.conversation.Conversation", "HAS_SEGMENT")
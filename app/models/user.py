@@ -1,6 +1,6 @@
 from neomodel import (
     StructuredNode, StringProperty, RelationshipTo, 
-    RelationshipFrom, StructuredRel, UniqueIdProperty, DateTimeProperty
+    RelationshipFrom, StructuredRel, UniqueIdProperty, DateTimeProperty, IntegerProperty
 )
 from datetime import datetime
 
@@ -14,6 +14,11 @@ class InvitationRel(StructuredRel):
 class ContactRel(StructuredRel):
     # Track when friendship was established
     created_at = DateTimeProperty(default=lambda: datetime.now())
+
+class MembershipRel(StructuredRel):
+    # Per-member read pointer: everything at or before it has been seen
+    last_read_at = DateTimeProperty(required=False)
+    last_read_seq = IntegerProperty(default=0)
 class User(StructuredNode):
     uid = UniqueIdProperty() 
     user_id = StringProperty(unique_index=True, required=True)
@@ -35,7 +40,7 @@ class User(StructuredNode):
     reset_token_expires_at = DateTimeProperty(required=False)  # Reset token expiry
 
     sent_messages = RelationshipTo("app.models.message.Message", "SENT")
-    member_of = RelationshipTo("app.models.conversation.Conversation", "MEMBER_OF")
+    member_of = RelationshipTo("app.models.conversation.Conversation", "MEMBER_OF", model=MembershipRel)
 
     sent_invitations = RelationshipTo("User", "INVITED", model=InvitationRel)
     received_invitations = RelationshipFrom("User", "INVITED", model=InvitationRel)
@@ -1,12 +1,20 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from typing import List
-from app.schemas.conversation import ConversationCreate, ConversationResponse, ConversationMember
+from typing import Optional
+from app.schemas.conversation import (
+    ConversationCreate, ConversationResponse, ConversationMember,
+    MarkReadRequest, ReadStateResponse, LastMessagePreview,
+)
 from app.crud.conversation import conversation_crud
 from app.routers.user import get_current_user
-from app.services.presence_manager import is_user_active
+from app.services.presence_manager import is_user_active, get_active_flags
+from app.services.ws_manager import manager as ws_manager
+from app.services.db_executor import run_db
 
 router = APIRouter(tags=["Conversations"])
 
+PREVIEW_LENGTH = 120  # characters of the last message shown in the inbox
+
 
 # ------------------------------------------------------------------
 # Create conversation
@@ -63,23 +71,40 @@ async def create_conversation(
 )
 async def list_user_conversations(current_user_id: str = Depends(get_current_user)):
     """
-    Return all conversations that include the authenticated user.
-    Adds online/offline status for each member via Redis.
+    Return the authenticated user's inbox, most recent activity first.
+    Each entry carries a last-message preview, the caller's unread count and
+    online/offline status for every member (one Neo4j query, one Redis call).
     """
-    convos = conversation_crud.list_user_conversations(current_user_id)
-    responses: List[ConversationResponse] = []
+    inbox = await run_db(conversation_crud.list_user_conversations, current_user_id)
+
+    member_ids = list({u.user_id for entry in inbox for u in entry["members"]})
+    active = await get_active_flags(member_ids)
 
-    for convo in convos:
-        members: List[ConversationMember] = []
-        for u in convo.members:
-            active = await is_user_active(u.user_id)
-            members.append(
-                ConversationMember(
-                    user_id=u.user_id,
-                    username=u.username,
-                    user_profile_url=u.profile_photo,
-                    is_active=active,
-                )
+    responses: List[ConversationResponse] = []
+    for entry in inbox:
+        convo = entry["conversation"]
+        members = [
+            ConversationMember(
+                user_id=u.user_id,
+                username=u.username,
+                user_profile_url=u.profile_photo,
+                is_active=active.get(u.user_id, False),
+            )
+            for u in entry["members"]
+        ]
+
+        last = entry["last_message"]
+        last_sender = entry["last_sender"]
+        preview = None
+        if last:
+            content = last.content or ""
+            preview = LastMessagePreview(
+                message_id=last.message_id,
+                seq=last.seq,
+                content=content[:PREVIEW_LENGTH] + ("…" if len(content) > PREVIEW_LENGTH else ""),
+                sender_id=getattr(last_sender, "user_id", None),
+                username=getattr(last_sender, "username", None),
+                timestamp=last.timestamp,
             )
 
         responses.append(
@@ -87,6 +112,10 @@ async def list_user_conversations(current_user_id: str = Depends(get_current_use
                 conversation_id=convo.conversation_id,
                 is_group=convo.is_group,
                 members=members,
+                unread_count=entry["unread_count"],
+                last_read_at=entry["last_read_at"],
+                last_read_seq=entry["last_read_seq"] or 0,
+                last_message=preview,
             )
         )
 
@@ -137,6 +166,37 @@ async def get_conversation(
     )
 
 
+# ------------------------------------------------------------------
+# Mark conversation as read
+# ------------------------------------------------------------------
+@router.post(
+    "/conversations/{conversation_id}/read",
+    response_model=ReadStateResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def mark_conversation_read(
+    conversation_id: str,
+    data: Optional[MarkReadRequest] = None,
+    current_user_id: str = Depends(get_current_user),
+):
+    """
+    Advance the caller's read pointer to `message_id` (or to now if omitted)
+    and return the remaining unread count.
+    """
+    state = await run_db(
+        conversation_crud.mark_read,
+        conversation_id,
+        current_user_id,
+        message_id=data.message_id if data else None,
+    )
+    if not state:
+        raise HTTPException(
+            status_code=404,
+            detail="Conversation, membership or message not found",
+        )
+    return ReadStateResponse(**state)
+
+
 # ------------------------------------------------------------------
 # Update conversation (e.g., toggle group/private)
 # ------------------------------------------------------------------
@@ -219,6 +279,7 @@ async def add_member_to_conversation(
     convo = conversation_crud.add_member(conversation_id, user_id)
     if not convo:
         raise HTTPException(status_code=404, detail="Conversation or User not found")
+    await ws_manager.invalidate_membership(conversation_id, user_id, is_member=True)
 
     from app.crud.user import user_crud  # inline import to avoid circular reference
     user = user_crud.get_user_by_id(user_id)
@@ -247,6 +308,7 @@ async def remove_member_from_conversation(
     convo = conversation_crud.remove_member(conversation_id, user_id)
     if not convo:
         raise HTTPException(status_code=404, detail="Conversation or User not found")
+    await ws_manager.invalidate_membership(conversation_id, user_id, is_member=False)
 
     from app.crud.user import user_crud
     user = user_crud.get_user_by_id(user_id)
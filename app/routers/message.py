@@ -1,19 +1,25 @@
 from fastapi import (
-    APIRouter, HTTPException, status, UploadFile, File, Form, Depends
+    APIRouter, HTTPException, status, UploadFile, File, Form, Depends, Query, Response
 )
+from fastapi.responses import StreamingResponse
+from anyio import from_thread
 from uuid import uuid4
-import boto3, os
+import boto3, os, zlib
 from dotenv import load_dotenv
 from typing import Optional, List
+from datetime import datetime
 
-from app.schemas.message import MessageCreate, MessageResponse
-from app.schemas.file import FileResponse
+from app.schemas.message import (
+    MessageCreate, MessageResponse, MessageSearchHit, MessageSyncResponse
+)
 from app.crud.message import message_crud
 from app.crud.file import file_crud
 from app.crud.conversation import conversation_crud
 from app.routers.user import get_current_user
 from app.services.presence_manager import get_active_user_ids
 from app.models.user import User
+from app.services import message_cache, idempotency
+from app.config import RECENT_MESSAGES_CACHE_SIZE
 
 load_dotenv()
 s3 = boto3.client(
@@ -26,14 +32,19 @@ bucket = os.getenv("AWS_BUCKET_NAME")
 
 router = APIRouter(tags=["Messages"])
 
+DEFAULT_PAGE_SIZE = 50  # history page size when `before` is given without `limit`
+EXPORT_BATCH_SIZE = 500  # messages per Neo4j round trip while exporting
+
 # ---------------------------------------------------------------------
 # 📨  Send new message
 # ---------------------------------------------------------------------
 @router.post("/messages", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 def send_new_message(
+    response: Response,
     conversation_id: str = Form(...),
     content: Optional[str] = Form(None),
     upload: Optional[UploadFile] = File(None),
+    client_message_id: Optional[str] = Form(None),
     current_user_id: str = Depends(get_current_user),
 ):
     """
@@ -42,59 +53,67 @@ def send_new_message(
       • actual file only
       • or both.
     When a file is given, it's uploaded to S3 and stored in Neo4j via file_crud.
+    With `client_message_id`, retries are idempotent: the original message is
+    returned (200) instead of creating a duplicate.
     """
     if not content and not upload:
         raise HTTPException(status_code=400, detail="Message must include text or an uploaded file.")
 
-    file_ids: List[str] = []
+    # ✅ Dedupe retries before doing any work (S3 upload included)
+    if client_message_id:
+        owned, original_id = from_thread.run(
+            idempotency.claim, current_user_id, client_message_id
+        )
+        if not owned:
+            original = message_crud.get_message_response(original_id) if original_id else None
+            if not original:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A message with this client_message_id is still being processed",
+                )
+            response.status_code = status.HTTP_200_OK
+            return original
 
-    # ✅ Handle S3 upload if file exists
-    if upload:
-        file_ext = os.path.splitext(upload.filename)[1]
-        s3_key = f"messages/{uuid4()}{file_ext}"
+    try:
+        file_ids: List[str] = []
 
-        s3.upload_fileobj(upload.file, bucket, s3_key)
-        file_url = f"https://{bucket}.s3.amazonaws.com/{s3_key}"
+        # ✅ Handle S3 upload if file exists
+        if upload:
+            file_ext = os.path.splitext(upload.filename)[1]
+            s3_key = f"messages/{uuid4()}{file_ext}"
 
-        # store File node
-        new_file = file_crud.create_file(
-            file_url=file_url,
-            file_type=upload.content_type,
-            size=upload.size if hasattr(upload, "size") else None,
+            s3.upload_fileobj(upload.file, bucket, s3_key)
+            file_url = f"https://{bucket}.s3.amazonaws.com/{s3_key}"
+
+            # store File node
+            new_file = file_crud.create_file(
+                file_url=file_url,
+                file_type=upload.content_type,
+                size=upload.size if hasattr(upload, "size") else None,
+            )
+            file_ids = [new_file.file_id]
+
+        # ✅ Create message node
+        created = message_crud.send_message(
+            sender_id=current_user_id,
+            conversation_id=conversation_id,
+            content=content,
+            file_ids=file_ids,
+            client_message_id=client_message_id,
         )
-        file_ids = [new_file.file_id]
+        if not created:
+            raise HTTPException(status_code=404, detail="Conversation or sender not found")
+    except Exception:
+        if client_message_id:
+            from_thread.run(idempotency.release, current_user_id, client_message_id)
+        raise
 
-    # ✅ Create message node
-    created = message_crud.send_message(
-        sender_id=current_user_id,
-        conversation_id=conversation_id,
-        content=content,
-        file_ids=file_ids,
-    )
-    if not created:
-        raise HTTPException(status_code=404, detail="Conversation or sender not found")
-
-    sender = created.sender.single()
-
-    files = [
-        FileResponse(
-            file_id=f.file_id,
-            url=f.url,
-            file_type=f.file_type,
-            size=f.size,
-        ) for f in created.attachments
-    ]
-
-    return MessageResponse(
-        message_id=created.message_id,
-        content=created.content,
-        timestamp=created.timestamp,
-        sender_id=current_user_id,
-        username=getattr(sender, "username", None),
-        user_profile_url=getattr(sender, "profile_photo", None),
-        conversation_id=conversation_id,
-        files=files,
-    )
+    if client_message_id:
+        from_thread.run(idempotency.complete, current_user_id, client_message_id, created.message_id)
+
+    # ✅ Keep the hot recent-messages cache current (sync route → loop thread)
+    from_thread.run(message_cache.push_message, created)
+    return created
 
 # ---------------------------------------------------------------------
 # 💬  Get all messages in a conversation
@@ -102,44 +121,141 @@ def send_new_message(
 @router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 def get_all_messages(
     conversation_id: str,
+    limit: Optional[int] = Query(None, ge=1, description="Only return the newest N messages"),
+    after: Optional[datetime] = Query(None, description="Only messages newer than this (e.g. last_read_at)"),
+    before: Optional[int] = Query(None, ge=1, description="History paging: only messages with seq < before"),
+    current_user_id: str = Depends(get_current_user),
+):
+    """
+    Fetch messages in a conversation (only participants can read).
+    With `limit`, returns the newest page, served from the Redis cache when warm.
+    With `after`, returns only messages newer than the given read pointer.
+    With `before` (a seq), pages back through history bucket by bucket.
+    """
+    # Verify membership before touching messages
+    convo = conversation_crud.get_conversation(conversation_id)
+    if not convo:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    member_ids = [m.user_id for m in convo.members]
+    if current_user_id not in member_ids:
+        raise HTTPException(status_code=403, detail="Access denied: not a member of this conversation")
+
+    if limit is not None and after is None and before is None:
+        cached = from_thread.run(message_cache.get_recent, conversation_id, limit)
+        if cached is not None:
+            return cached
+
+        # Miss → load a full cache page so the next open is served from Redis
+        # (skipped if a send lands between the read and the fill)
+        token = from_thread.run(message_cache.fill_token, conversation_id)
+        fetch = max(limit, RECENT_MESSAGES_CACHE_SIZE)
+        page = message_crud.get_recent_messages(conversation_id, fetch)
+        from_thread.run(message_cache.fill, conversation_id, page, len(page) < fetch, token)
+        return page[-limit:]
+
+    if before is not None:
+        return message_crud.get_message_page(conversation_id, limit or DEFAULT_PAGE_SIZE, before_seq=before)
+
+    messages = message_crud.get_messages_in_conversation(conversation_id, after=after)
+    if limit is not None:
+        messages = messages[-limit:]
+    return messages
+
+
+# ---------------------------------------------------------------------
+# 🔄  Delta sync for reconnecting clients
+# ---------------------------------------------------------------------
+@router.get("/conversations/{conversation_id}/sync", response_model=MessageSyncResponse)
+def sync_messages(
+    conversation_id: str,
+    since: int = Query(0, ge=0, description="Last message seq the client has"),
+    since_change: int = Query(0, ge=0, description="Last change_seq the client has"),
+    limit: int = Query(200, ge=1, le=1000),
     current_user_id: str = Depends(get_current_user),
 ):
-    """Fetch all messages in a conversation (only participants can read)."""
-    messages = message_crud.get_messages_in_conversation(conversation_id)
-    if messages is None:
+    """
+    Return only what changed since the client's cursors: new messages,
+    edits and deletions. Pass `last_seq` / `last_change_seq` back on the next
+    call; keep calling while `has_more` is true.
+    """
+    convo = conversation_crud.get_conversation(conversation_id)
+    if not convo:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    member_ids = [m.user_id for m in convo.members]
+    if current_user_id not in member_ids:
+        raise HTTPException(status_code=403, detail="Access denied: not a member of this conversation")
+
+    changes = message_crud.get_changes(
+        conversation_id, since=since, since_change=since_change, limit=limit
+    )
+    if changes is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    return changes
 
-    # Optional: verify membership (good practice)
+
+# ---------------------------------------------------------------------
+# 📦  Streaming export (NDJSON, optionally gzip)
+# ---------------------------------------------------------------------
+@router.get("/conversations/{conversation_id}/export")
+def export_conversation(
+    conversation_id: str,
+    gzip: bool = Query(False, description="Compress the stream on the fly"),
+    current_user_id: str = Depends(get_current_user),
+):
+    """
+    Stream the full history as NDJSON (one MessageResponse per line).
+    Messages are pulled from Neo4j in fixed-size batches, so memory stays
+    constant regardless of conversation size.
+    """
     convo = conversation_crud.get_conversation(conversation_id)
+    if not convo:
+        raise HTTPException(status_code=404, detail="Conversation not found")
     member_ids = [m.user_id for m in convo.members]
     if current_user_id not in member_ids:
         raise HTTPException(status_code=403, detail="Access denied: not a member of this conversation")
 
-    results: list[MessageResponse] = []
-    for msg in messages:
-        sender = msg.sender.single()
-        results.append(
-            MessageResponse(
-                message_id=msg.message_id,
-                content=msg.content,
-                timestamp=msg.timestamp,
-                sender_id=getattr(sender, "user_id", None),
-                username=getattr(sender, "username", None),
-                user_profile_url=getattr(sender, "profile_photo", None),
-                conversation_id=conversation_id,
-                files=[
-                    FileResponse(
-                        file_id=f.file_id,
-                        url=f.url,
-                        file_type=f.file_type,
-                        size=f.size,
-                    )
-                    for f in msg.attachments
-                ],
-            )
-        )
+    def ndjson():
+        for msg in message_crud.iter_messages(conversation_id, batch_size=EXPORT_BATCH_SIZE):
+            yield (msg.model_dump_json() + "\n").encode("utf-8")
+
+    def gzipped():
+        compressor = zlib.compressobj(wbits=31)   # 31 → gzip container
+        for chunk in ndjson():
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    filename = f"conversation-{conversation_id}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        gzipped() if gzip else ndjson(),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-    return results
+
+# ---------------------------------------------------------------------
+# 🔎  Search messages in the caller's conversations
+# ---------------------------------------------------------------------
+@router.get("/messages/search", response_model=List[MessageSearchHit])
+def search_messages(
+    q: str = Query(..., min_length=1, description="Search text"),
+    conversation_id: Optional[str] = Query(None, description="Restrict to one conversation"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_user_id: str = Depends(get_current_user),
+):
+    """
+    Full-text search over message content. Only conversations the caller is a
+    member of are searched; each hit carries a highlighted snippet.
+    """
+    return message_crud.search_messages(
+        current_user_id,
+        q,
+        conversation_id=conversation_id,
+        skip=skip,
+        limit=limit,
+    )
 
 
 # ---------------------------------------------------------------------
@@ -188,26 +304,15 @@ def update_message(
     if not updated:
         raise HTTPException(status_code=500, detail="Failed to update message")
 
-    convo = updated.in_conversation.single()
-    files = [
-        FileResponse(
-            file_id=f.file_id,
-            url=f.url,
-            file_type=f.file_type,
-            size=f.size,
-        ) for f in updated.attachments
-    ]
-
-    return MessageResponse(
-        message_id=updated.message_id,
-        content=updated.content,
-        timestamp=updated.timestamp,
-        sender_id=sender_rel.user_id,
-        username=sender_rel.username,
-        user_profile_url=sender_rel.profile_photo,
-        conversation_id=convo.conversation_id if convo else None,
-        files=files,
+    response = message_crud.build_response(
+        updated,
+        sender_rel,
+        list(updated.attachments),
+        updated.conversation_id,
     )
+
+    from_thread.run(message_cache.replace_message, updated.conversation_id, message_id, response)
+    return response
 # ---------------------------------------------------------------------
 # ❌  Delete message
 # ---------------------------------------------------------------------
@@ -239,6 +344,14 @@ def delete_message(
         delete_files=delete_files,
     )
 
+    cached = (
+        message_crud.build_response(
+            result, sender_rel, list(result.attachments), msg.conversation_id
+        )
+        if result is not None else None
+    )
+    from_thread.run(message_cache.replace_message, msg.conversation_id, message_id, cached)
+
     # Full deletion returns None
     if result is None:
         return {"detail": "Message fully deleted"}
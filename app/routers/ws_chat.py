@@ -1,9 +1,15 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from app.services.ws_manager import manager
+import asyncio
+import secrets
+from typing import Iterable, Optional
+from fastapi import APIRouter, Header, HTTPException, WebSocket, WebSocketDisconnect, status
+from app import config
+from app.config import verify_access_token
+from app.services.ws_manager import manager, Connection, decode_frame
+from app.services.presence_manager import mark_user_active, mark_user_inactive
 from app.crud.message import message_crud
 from app.crud.conversation import conversation_crud
-from app.models.user import User
-from app.schemas.message import MessageResponse, FileResponse
+from app.services import message_cache, idempotency, rate_limiter, offline_queue
+from app.services.db_executor import run_db
 import logging
 
 # ✅ log router initialization once at import
@@ -12,89 +18,306 @@ log.info("✅ WS router initialized")
 
 router = APIRouter(prefix="/ws", tags=["WebSocket Chat"])
 
+# Ephemeral frame types and the minimum seconds between relays per user and conversation
+EPHEMERAL_THROTTLE = {
+    "typing": config.WS_TYPING_THROTTLE,
+    "read": config.WS_READ_ACK_THROTTLE,
+}
+
+
+def _token_from(websocket: WebSocket) -> Optional[str]:
+    """JWT from `?token=` (browsers can't set headers on a WebSocket) or a Bearer header."""
+    token = websocket.query_params.get("token")
+    if token:
+        return token
+    auth = websocket.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        return auth[7:]
+    return None
+
+
+def _authenticate(websocket: WebSocket) -> Optional[str]:
+    """user_id from the handshake token, or None if it is missing/invalid."""
+    try:
+        payload = verify_access_token(_token_from(websocket) or "")
+    except HTTPException:
+        return None
+    return payload.get("sub")
+
+
+def _flag(websocket: WebSocket, name: str) -> bool:
+    return websocket.query_params.get(name, "").lower() in ("1", "true", "yes")
+
+
+def _wants_msgpack(websocket: WebSocket) -> bool:
+    return websocket.query_params.get("encoding", "json").lower() == "msgpack"
+
+
+async def _refuse_if_draining(websocket: WebSocket) -> bool:
+    """Turn away new sockets while the server shuts down (clients retry elsewhere)."""
+    if not manager.draining:
+        return False
+    await websocket.close(code=status.WS_1012_SERVICE_RESTART, reason="Server restarting")
+    return True
+
+
+async def _receive(websocket: WebSocket) -> dict:
+    """Next client frame, JSON text or MessagePack binary (raises on close or a bad payload)."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+    raw = message.get("bytes")
+    data = decode_frame(raw if raw is not None else message.get("text") or "")
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON/MessagePack object")
+    return data
+
+
+def _handle_heartbeat(conn: Connection, data: dict) -> bool:
+    """Record activity; answer pings and swallow pongs. True if the frame was consumed."""
+    manager.touch(conn)
+    frame_type = data.get("type")
+    if frame_type == "pong":
+        return True
+    if frame_type == "ping":
+        manager.send(conn, {"type": "pong"})
+        return True
+    return False
+
+
+async def _relay_ephemeral(conn: Connection, conversation_id: str, data: dict) -> None:
+    """
+    Relay a typing indicator or read-ack to the conversation, locally and over
+    the bus. Nothing is stored: the persisted read pointer stays with
+    POST /conversations/{id}/read. Repeats are throttled per user.
+    """
+    frame_type = data["type"]
+    if frame_type == "typing":
+        is_typing = bool(data.get("is_typing", True))
+        event = {"type": "typing", "conversation_id": conversation_id,
+                 "user_id": conn.user_id, "is_typing": is_typing}
+        throttled = is_typing      # "stopped typing" always goes through
+    else:
+        seq = data.get("seq")
+        event = {"type": "read", "conversation_id": conversation_id, "user_id": conn.user_id,
+                 "message_id": data.get("message_id"), "seq": seq if isinstance(seq, int) else None}
+        throttled = True
+    if throttled and not manager.allow_event(conn.user_id, conversation_id, frame_type,
+                                             EPHEMERAL_THROTTLE[frame_type]):
+        return
+    await manager.broadcast(conversation_id, event, kind=frame_type)
+
+
+async def _wait_for_send_slot(conn: Connection, conversation_id: str, data: dict) -> None:
+    """
+    Enforce the per-connection and per-user send limits. While over the limit,
+    tell the client and stop reading from the socket until a token frees up,
+    so a flooding client is slowed to the limit instead of reaching Neo4j.
+    """
+    while True:
+        wait = conn.send_bucket.take()
+        if not wait:
+            wait = await rate_limiter.take_user_token(conn.user_id)
+            if not wait:
+                return
+            conn.send_bucket.give_back()   # refused per user: don't drain this socket's budget too
+        manager.rate_limited_total += 1
+        manager.send(conn, {
+            "type": "throttled",
+            "conversation_id": conversation_id,
+            "client_message_id": data.get("client_message_id"),
+            "retry_after": round(wait, 3),
+        })
+        await asyncio.sleep(wait)
+
+
+async def _handle_chat_message(conn: Connection, conversation_id: str, data: dict) -> None:
+    """Persist one chat message from `conn` and broadcast it to the conversation."""
+    await _wait_for_send_slot(conn, conversation_id, data)
+    sender_id = conn.user_id
+    content = data.get("content", "")
+    file_ids = data.get("file_ids", [])
+    client_message_id = data.get("client_message_id")
+
+    # --- Dedupe client retries ---
+    if client_message_id:
+        owned, original_id = await idempotency.claim(sender_id, client_message_id)
+        if not owned:
+            original = await run_db(message_crud.get_message_response, original_id) if original_id else None
+            if original:
+                manager.send(conn, original.model_dump_json())
+            else:
+                manager.send(conn, {"error": "Duplicate message still processing.",
+                                    "conversation_id": conversation_id})
+            return
+
+    # --- Create message in DB (off the event loop) ---
+    try:
+        new_message = await run_db(
+            message_crud.send_message,
+            sender_id=sender_id,
+            conversation_id=conversation_id,
+            content=content,
+            file_ids=file_ids,
+            client_message_id=client_message_id,
+        )
+    except Exception:
+        if client_message_id:
+            await idempotency.release(sender_id, client_message_id)
+        raise
+    if not new_message:
+        if client_message_id:
+            await idempotency.release(sender_id, client_message_id)
+        manager.send(conn, {"error": "Failed to create message.", "conversation_id": conversation_id})
+        return
+    if client_message_id:
+        await idempotency.complete(sender_id, client_message_id, new_message.message_id)
+
+    # --- Cache + broadcast message (encoded once for both) ---
+    frame = new_message.model_dump_json()
+    await message_cache.push_message(new_message, frame)
+    await manager.broadcast(conversation_id, frame)
+    await offline_queue.enqueue_for_offline(conversation_id, frame, exclude_user_id=sender_id)
+
+
+async def _announce_presence(user_id: str, conversation_ids: Iterable[str], is_active: bool) -> None:
+    for conversation_id in conversation_ids:
+        await manager.broadcast(conversation_id, {
+            "type": "presence",
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "is_active": is_active,
+        }, kind="presence")
+
 
 @router.websocket("/conversations/{conversation_id}")
 async def websocket_endpoint(websocket: WebSocket, conversation_id: str):
     """
-    WebSocket endpoint for a conversation.
-    Expects client to send JSON:
-      {"sender_id": "...", "content": "...", "file_ids": [...]}
-    Broadcasts messages to every connected client.
+    WebSocket endpoint for a conversation: `?token=<access token>`, membership
+    checked once at the handshake (1008 if either fails). Frames, flags and
+    close codes are described in ARCHITECTURE.md, "Real-time Chat (WebSocket)".
     """
-    await manager.connect(conversation_id, websocket)
+    if await _refuse_if_draining(websocket):
+        return
+    # --- Authenticate ---
+    sender_id = _authenticate(websocket)
+    if not sender_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or missing token")
+        return
+
+    # --- Authorize once; cached on the socket until add/remove_member invalidates it ---
+    if not await run_db(conversation_crud.get_member, conversation_id, sender_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION,
+                              reason="Not a member of this conversation")
+        return
+
+    kinds = EPHEMERAL_THROTTLE.keys() if _flag(websocket, "ephemeral") else ()
+    conn = await manager.connect(websocket, sender_id, [conversation_id], kinds=kinds,
+                                 binary=_wants_msgpack(websocket),
+                                 heartbeat=_flag(websocket, "heartbeat"))
 
     try:
         while True:
             try:
-                data = await websocket.receive_json()
+                data = await _receive(websocket)
             except Exception:
                 # Client likely disconnected or sent invalid JSON
                 log.warning("[WS] Invalid payload or forced close.")
                 break
 
-            sender_id = data.get("sender_id")
-            content = data.get("content", "")
-            file_ids = data.get("file_ids", [])
-
-            # --- Validate conversation ---
-            convo = conversation_crud.get_conversation(conversation_id)
-            if not convo:
-                await websocket.send_json({"error": "Conversation not found."})
-                continue
-
-            # --- Validate sender ---
-            sender = User.nodes.get_or_none(user_id=sender_id)
-            if not sender:
-                await websocket.send_json({"error": "Invalid sender_id."})
-                continue
-
-            # --- Verify membership ---
-            member_ids = [m.user_id for m in convo.members]
-            if sender_id not in member_ids:
-                await websocket.send_json({"error": "Sender not in this conversation."})
+            if not conn.is_member:
+                break
+            if _handle_heartbeat(conn, data):
                 continue
-
-            # --- Create message in DB ---
-            new_message = message_crud.send_message(
-                sender_id=sender_id,
-                conversation_id=conversation_id,
-                content=content,
-                file_ids=file_ids,
-            )
-            if not new_message:
-                await websocket.send_json({"error": "Failed to create message."})
+            if data.get("type") in EPHEMERAL_THROTTLE:
+                await _relay_ephemeral(conn, conversation_id, data)
                 continue
-
-            # --- Build response payload ---
-            sender_obj = new_message.sender.single()
-            attachments = list(new_message.attachments)
-
-            msg_response = MessageResponse(
-                message_id=new_message.message_id,
-                content=new_message.content,
-                timestamp=new_message.timestamp,
-                sender_id=sender_obj.user_id,
-                username=getattr(sender_obj, "username", None),
-                user_profile_url=getattr(sender_obj, "profile_photo", None),
-                conversation_id=conversation_id,
-                files=[
-                    FileResponse(
-                        file_id=f.file_id,
-                        url=f.url,
-                        file_type=f.file_type,
-                        size=f.size,
-                    )
-                    for f in attachments
-                ],
-            ).model_dump()
-
-            # --- Broadcast message ---
-            await manager.broadcast(conversation_id, msg_response)
+            await _handle_chat_message(conn, conversation_id, data)
 
     except WebSocketDisconnect:
-        manager.disconnect(conversation_id, websocket)
         log.info(f"[WS] Client disconnected from conversation {conversation_id}")
     except Exception as e:
         # Catch-all for unexpected runtime errors; avoids abrupt close
         log.exception(f"[WS] Unexpected error in conversation {conversation_id}: {e}")
-        manager.disconnect(conversation_id, websocket)
\ No newline at end of file
+    finally:
+        # Also reached after a bad payload breaks the loop, so the socket
+        # (and this worker's channel subscription) never leaks.
+        await manager.disconnect(conn)
+
+
+@router.websocket("")
+async def user_websocket_endpoint(websocket: WebSocket):
+    """
+    One multiplexed socket per user for all of their conversations; missed
+    messages are delivered first on connect. Protocol: ARCHITECTURE.md,
+    "Real-time Chat (WebSocket)".
+    """
+    if await _refuse_if_draining(websocket):
+        return
+    user_id = _authenticate(websocket)
+    if not user_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or missing token")
+        return
+
+    kinds = [*EPHEMERAL_THROTTLE]
+    kinds += [kind for flag, kind in (("notifications", "notification"), ("presence", "presence"))
+              if _flag(websocket, flag)]
+    conn = await manager.connect(
+        websocket, user_id, await run_db(conversation_crud.get_conversation_ids, user_id),
+        multiplexed=True, kinds=kinds, binary=_wants_msgpack(websocket), heartbeat=True,
+    )
+    for frame in await offline_queue.drain(user_id):   # what was missed while offline
+        manager.send(conn, frame)
+    await mark_user_active(user_id)
+    await _announce_presence(user_id, list(conn.conversations), True)
+
+    try:
+        while True:
+            try:
+                data = await _receive(websocket)
+            except Exception:
+                log.warning("[WS] Invalid payload or forced close.")
+                break
+
+            if _handle_heartbeat(conn, data):
+                continue
+            conversation_id = data.get("conversation_id")
+            frame_type = data.get("type", "message")
+            if conversation_id not in conn.conversations:
+                manager.send(conn, {"error": "Not a member of this conversation.",
+                                    "conversation_id": conversation_id})
+                continue
+            if frame_type in EPHEMERAL_THROTTLE:
+                await _relay_ephemeral(conn, conversation_id, data)
+            elif frame_type == "message":
+                await _handle_chat_message(conn, conversation_id, data)
+            else:
+                manager.send(conn, {"error": "Unsupported frame type.", "conversation_id": conversation_id})
+
+    except WebSocketDisconnect:
+        log.info(f"[WS] User {user_id} disconnected")
+    except Exception as e:
+        log.exception(f"[WS] Unexpected error on user socket {user_id}: {e}")
+    finally:
+        conversation_ids = list(conn.conversations)
+        await manager.disconnect(conn)
+        left = conn.online_left       # /ws sockets the user still has on any worker
+        if left is None:              # no Redis: this worker is all we know
+            left = len(manager.user_connections.get(user_id, ()))
+        if left == 0:
+            await mark_user_inactive(user_id)
+            await _announce_presence(user_id, conversation_ids, False)
+
+
+@router.get("/metrics")
+async def websocket_metrics(authorization: str = Header("")):
+    """
+    Connection count and outbound queue depths for this worker (operators only:
+    Bearer WS_METRICS_TOKEN; 404 when no token is configured).
+    """
+    expected = config.WS_METRICS_TOKEN
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {expected}".encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return manager.metrics()
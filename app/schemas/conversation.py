@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from datetime import datetime
 
 
 class ConversationCreate(BaseModel):
@@ -14,7 +15,31 @@ class ConversationMember(BaseModel):
     is_active: Optional[bool] = False   # 👈 new field
 
 
+class LastMessagePreview(BaseModel):
+    message_id: str
+    seq: Optional[int] = None
+    content: Optional[str] = None              # snippet, truncated
+    sender_id: Optional[str] = None
+    username: Optional[str] = None
+    timestamp: datetime
+
+
 class ConversationResponse(BaseModel):
     conversation_id: str
     is_group: bool
-    members: List[ConversationMember]
\ No newline at end of file
+    members: List[ConversationMember]
+    unread_count: int = 0                      # messages after the caller's read pointer
+    last_read_at: Optional[datetime] = None
+    last_read_seq: int = 0
+    last_message: Optional[LastMessagePreview] = None
+
+
+class MarkReadRequest(BaseModel):
+    message_id: Optional[str] = None           # None → mark everything as read
+
+
+class ReadStateResponse(BaseModel):
+    conversation_id: str
+    last_read_at: Optional[datetime] = None
+    last_read_seq: int = 0
+    unread_count: int = 0
\ No newline at end of file
@@ -8,6 +8,7 @@ class MessageCreate(BaseModel):
     conversation_id: str
     content: Optional[str] = None              # ✅ allow empty for file‑only
     file_ids: Optional[List[str]] = []         # optional multiple attachments
+    client_message_id: Optional[str] = None    # retries with the same id are deduped
 
 
 class MessageResponse(BaseModel):
@@ -18,4 +19,23 @@ class MessageResponse(BaseModel):
     username: Optional[str] = None             # ✅ for display
     user_profile_url: Optional[str] = None     # ✅ show avatar
     conversation_id: str
-    files: List[FileResponse] = []
\ No newline at end of file
+    files: List[FileResponse] = []
+    seq: Optional[int] = None                  # per-conversation send order
+    edited_at: Optional[datetime] = None
+    client_message_id: Optional[str] = None    # echo of the sender's dedupe id
+
+
+class MessageSearchHit(BaseModel):
+    message: MessageResponse
+    score: float
+    snippet: str                               # HTML-escaped, matches wrapped in <mark>
+
+
+class MessageSyncResponse(BaseModel):
+    conversation_id: str
+    messages: List[MessageResponse] = []       # new since `since`, in seq order
+    updated: List[MessageResponse] = []        # already-seen messages edited since `since_change`
+    deleted: List[str] = []                    # already-seen message_ids deleted since `since_change`
+    last_seq: int                              # pass back as `since`
+    last_change_seq: int                       # pass back as `since_change`
+    has_more: bool = False                     # more new messages past `last_seq`
@@ -0,0 +1,54 @@
+# app/server.py
+"""
+Production entry point: uvicorn with a WebSocket drain in front of shutdown.
+
+uvicorn's own shutdown closes every open socket with 1012 before the app's
+shutdown event runs, so a drain started there finds nothing left to drain.
+DrainingServer runs ws_manager.drain() first, on SIGTERM / Ctrl+C, while the
+sockets are still open: new sockets are refused, every client is told to
+reconnect after a jittered delay and its queued frames are flushed. Only then
+does uvicorn stop listening, close what is left and run the lifespan shutdown.
+A second Ctrl+C skips the drain.
+
+    python -m app.server [--host 0.0.0.0] [--port 8000] [--workers 4]
+"""
+import argparse
+import math
+import sys
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from app import config
+from app.services.ws_manager import CLOSE_TIMEOUT, manager
+
+
+class DrainingServer(uvicorn.Server):
+    async def shutdown(self, sockets=None) -> None:
+        if not self.force_exit:
+            await manager.drain()
+        await super().shutdown(sockets=sockets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    server_config = uvicorn.Config(
+        "app.main:app", host=args.host, port=args.port, workers=args.workers,
+        # Room for sockets the drain had to close the hard way
+        timeout_graceful_shutdown=math.ceil(config.WS_DRAIN_TIMEOUT + CLOSE_TIMEOUT),
+    )
+    server = DrainingServer(server_config)
+    if server_config.workers > 1:
+        Multiprocess(server_config, target=server.run, sockets=[server_config.bind_socket()]).run()
+    else:
+        server.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# app/services/db_executor.py
+"""
+Bounded thread pool for the blocking Neo4j (neomodel / Bolt) calls made from
+async code.
+
+The WebSocket handlers are coroutines; calling the sync CRUD layer from them
+directly blocks the event loop for the length of the query and freezes every
+socket and async route on the worker. `run_db` runs the call on this pool
+instead. The pool is bounded (DB_EXECUTOR_WORKERS) so a burst of sockets can't
+hold more concurrent Bolt sessions than the driver pool serves; extra calls
+wait their turn without blocking the loop.
+
+Settings are read from the environment here (not app.config) so the module
+can be imported without a database connection.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", 16))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="neo4j-db")
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Await a blocking database call without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown() -> None:
+    """Stop the pool at app shutdown; queued calls are cancelled."""
+    _executor.shutdown(wait=False, cancel_futures=True)
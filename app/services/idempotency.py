@@ -0,0 +1,84 @@
+# app/services/idempotency.py
+"""
+Idempotent message sends keyed by a client-generated id.
+
+  msg:client:<sender_id>:<client_message_id> → "pending" | <message_id>
+
+The first request claims the key with SET NX for CLIENT_MESSAGE_ID_PENDING_TTL
+and stores the created message_id for CLIENT_MESSAGE_ID_TTL when done; retries
+inside that window get the original message_id instead of creating a duplicate.
+A claim whose sender died expires quickly, so retries aren't blocked for long.
+Without Redis every send goes through.
+"""
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from app import config
+
+log = logging.getLogger("uvicorn.error")
+
+PREFIX = "msg:client"
+PENDING = "pending"
+WAIT_SECONDS = 2.0        # how long a retry waits for an in-flight original
+POLL_INTERVAL = 0.05
+
+
+def _key(sender_id: str, client_message_id: str) -> str:
+    return f"{PREFIX}:{sender_id}:{client_message_id}"
+
+
+async def claim(sender_id: str, client_message_id: str) -> Tuple[bool, Optional[str]]:
+    """
+    Try to own the send for this client id.
+    Returns (True, None) if the caller should create the message, otherwise
+    (False, message_id) for the original — message_id is None if the original
+    is still in flight after WAIT_SECONDS.
+    """
+    r = config.redis_client
+    if not r:
+        return True, None
+    key = _key(sender_id, client_message_id)
+    try:
+        if await r.set(key, PENDING, nx=True, ex=config.CLIENT_MESSAGE_ID_PENDING_TTL):
+            return True, None
+
+        deadline = asyncio.get_running_loop().time() + WAIT_SECONDS
+        while True:
+            value = await r.get(key)
+            if value is None:
+                # Original failed and released the key → retry owns it now
+                if await r.set(key, PENDING, nx=True, ex=config.CLIENT_MESSAGE_ID_PENDING_TTL):
+                    return True, None
+            elif value != PENDING:
+                return False, value
+            if asyncio.get_running_loop().time() >= deadline:
+                return False, None
+            await asyncio.sleep(POLL_INTERVAL)
+    except RedisError as e:
+        log.warning(f"[idempotency] claim failed for {key}: {e}")
+        return True, None
+
+
+async def complete(sender_id: str, client_message_id: str, message_id: str) -> None:
+    """Record the created message so later retries resolve to it."""
+    r = config.redis_client
+    if not r:
+        return
+    try:
+        await r.set(_key(sender_id, client_message_id), message_id, ex=config.CLIENT_MESSAGE_ID_TTL)
+    except RedisError as e:
+        log.warning(f"[idempotency] complete failed for {client_message_id}: {e}")
+
+
+async def release(sender_id: str, client_message_id: str) -> None:
+    """Drop a claim after a failed send so the client's retry can go through."""
+    r = config.redis_client
+    if not r:
+        return
+    try:
+        await r.delete(_key(sender_id, client_message_id))
+    except RedisError as e:
+        log.warning(f"[idempotency] release failed for {client_message_id}: {e}")
@@ -0,0 +1,198 @@
+# app/services/message_cache.py
+"""
+Redis list cache of the last N serialized MessageResponses per conversation.
+
+Layout (newest message first):
+  chat:recent:{<conversation_id>}           → LIST of MessageResponse JSON
+  chat:recent:{<conversation_id>}:complete  → flag: the list holds the whole history
+  chat:recent:{<conversation_id>}:gen       → counter bumped by every push, edit and delete
+
+The cache is warmed on the first read of a conversation and then kept current
+by pushes on send, so the first page of an active conversation never hits Neo4j.
+A warm-up takes a fill_token() before reading Neo4j and only writes its page if
+no message was pushed in between (a push on a cold cache is a no-op, so the
+page would otherwise miss that message — or keep an edited/deleted one — for good).
+All operations are best-effort: a Redis failure falls back to Neo4j.
+"""
+import logging
+from typing import List, Optional
+
+from redis.exceptions import RedisError
+
+from app import config
+from app.schemas.message import MessageResponse
+
+log = logging.getLogger("uvicorn.error")
+
+PREFIX = "chat:recent"
+
+# Push only when the conversation is already cached (list or "complete" flag),
+# otherwise a lone new message would look like a full first page. The
+# generation is bumped either way so a concurrent warm-up knows it's stale.
+_PUSH_SCRIPT = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 1 or redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('LPUSH', KEYS[1], ARGV[1])
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Replace the page unless a push happened since the warm-up's token was taken.
+# ARGV: token, ttl, complete (0/1), entries newest first.
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+if #ARGV > 3 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 4))
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if ARGV[3] == '1' then
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+end
+return 1
+"""
+
+
+# Patch (ARGV[2] = new JSON) or drop (ARGV[2] = "") the entry with message_id
+# ARGV[1], matched inside the script so a concurrent LPUSH can't shift the index.
+_PATCH_SCRIPT = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i, item in ipairs(items) do
+    if cjson.decode(item)['message_id'] == ARGV[1] then
+        if ARGV[2] == '' then
+            redis.call('LREM', KEYS[1], 1, item)
+        else
+            redis.call('LSET', KEYS[1], i - 1, ARGV[2])
+        end
+        return 1
+    end
+end
+return 0
+"""
+
+
+def _keys(conversation_id: str) -> tuple[str, str, str]:
+    # Hash tag keeps all keys in the same cluster slot for the Lua scripts.
+    base = f"{PREFIX}:{{{conversation_id}}}"
+    return base, f"{base}:complete", f"{base}:gen"
+
+
+async def push_message(message: MessageResponse, encoded: Optional[str] = None) -> None:
+    """
+    Prepend a freshly sent message and trim the list to the cache size.
+    `encoded` is the message's model_dump_json(), if the caller already has it.
+    """
+    r = config.redis_client
+    if not r:
+        return
+    try:
+        await r.eval(
+            _PUSH_SCRIPT, 3, *_keys(message.conversation_id),
+            encoded or message.model_dump_json(),
+            config.RECENT_MESSAGES_CACHE_SIZE,
+            config.RECENT_MESSAGES_CACHE_TTL,
+        )
+    except RedisError as e:
+        log.warning(f"[cache] push failed for {message.conversation_id}: {e}")
+
+
+async def get_recent(conversation_id: str, limit: int) -> Optional[List[MessageResponse]]:
+    """
+    Return the last `limit` messages (oldest first) or None on a cache miss.
+    A hit needs either `limit` cached entries or a cache holding the full history.
+    """
+    r = config.redis_client
+    if not r or limit > config.RECENT_MESSAGES_CACHE_SIZE:
+        return None
+    list_key, complete_key, _ = _keys(conversation_id)
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.lrange(list_key, 0, limit - 1)
+            pipe.exists(complete_key)
+            raw, complete = await pipe.execute()
+    except RedisError as e:
+        log.warning(f"[cache] read failed for {conversation_id}: {e}")
+        return None
+
+    if len(raw) < limit and not complete:
+        return None
+    return [MessageResponse.model_validate_json(item) for item in reversed(raw)]
+
+
+async def fill_token(conversation_id: str) -> Optional[str]:
+    """
+    Take before reading the page from Neo4j and pass to fill().
+    None means Redis is unavailable and the page shouldn't be cached.
+    """
+    r = config.redis_client
+    if not r:
+        return None
+    try:
+        return await r.get(_keys(conversation_id)[2]) or "0"
+    except RedisError as e:
+        log.warning(f"[cache] token read failed for {conversation_id}: {e}")
+        return None
+
+
+async def fill(conversation_id: str, messages: List[MessageResponse], complete: bool,
+               token: Optional[str]) -> None:
+    """
+    Replace the cached page with `messages` (oldest first), unless a message
+    was pushed since `token` was taken — the page may lack it; the next read warms again.
+    """
+    r = config.redis_client
+    if not r or token is None:
+        return
+    newest_first = [m.model_dump_json() for m in reversed(messages)]
+    newest_first = newest_first[: config.RECENT_MESSAGES_CACHE_SIZE]
+    try:
+        await r.eval(
+            _FILL_SCRIPT, 3, *_keys(conversation_id),
+            token, config.RECENT_MESSAGES_CACHE_TTL, int(complete), *newest_first,
+        )
+    except RedisError as e:
+        log.warning(f"[cache] fill failed for {conversation_id}: {e}")
+
+
+async def replace_message(
+    conversation_id: str,
+    message_id: str,
+    message: Optional[MessageResponse],
+) -> None:
+    """
+    Patch a cached entry after an edit, or drop it after a full delete
+    (`message=None`). Messages outside the cached window are ignored.
+    """
+    r = config.redis_client
+    if not r:
+        return
+    try:
+        await r.eval(
+            _PATCH_SCRIPT, 3, *_keys(conversation_id),
+            message_id, message.model_dump_json() if message else "",
+            config.RECENT_MESSAGES_CACHE_TTL,
+        )
+    except RedisError as e:
+        # A stale entry is worse than a miss: drop the whole page.
+        log.warning(f"[cache] patch failed for {conversation_id}: {e}")
+        await invalidate(conversation_id)
+
+
+async def invalidate(conversation_id: str) -> None:
+    """Forget the cached page for a conversation."""
+    r = config.redis_client
+    if not r:
+        return
+    try:
+        await r.delete(*_keys(conversation_id)[:2])
+    except RedisError as e:
+        log.warning(f"[cache] invalidate failed for {conversation_id}: {e}")
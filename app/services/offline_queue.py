@@ -0,0 +1,146 @@
+# app/services/offline_queue.py
+"""
+Pending-delivery queues for members who aren't connected when a message is sent.
+
+  ws:online:<user_id>   → number of the user's /ws (multiplexed) sockets, all workers;
+                          expires unless a heartbeat refreshes it, so a crashed
+                          worker can't leave users "online" forever
+  ws:pending:<user_id>  → STREAM of encoded frames, capped at WS_PENDING_MAXLEN
+
+After a chat message is broadcast, every member without a /ws socket gets
+the frame appended to their stream. The next /ws connection drains the stream
+before live traffic is read, so the client gets exactly what it missed
+without a history query. Frames may also arrive live around the reconnect;
+clients dedupe by message_id and order by seq.
+"""
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from app import config
+from app.crud.conversation import conversation_crud
+from app.services.db_executor import run_db
+
+log = logging.getLogger("uvicorn.error")
+
+ONLINE_PREFIX = "ws:online"
+PENDING_PREFIX = "ws:pending"
+FIELD = "f"
+
+# conversation_id → (expires_at, member ids); dropped on membership changes
+_members: Dict[str, Tuple[float, Tuple[str, ...]]] = {}
+
+
+def _online_key(user_id: str) -> str:
+    return f"{ONLINE_PREFIX}:{user_id}"
+
+
+def _pending_key(user_id: str) -> str:
+    return f"{PENDING_PREFIX}:{user_id}"
+
+
+async def _member_ids(conversation_id: str) -> Tuple[str, ...]:
+    cached = _members.get(conversation_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    ids = tuple(await run_db(conversation_crud.get_member_ids, conversation_id))
+    _members[conversation_id] = (time.monotonic() + config.WS_MEMBER_CACHE_TTL, ids)
+    return ids
+
+
+def forget_members(conversation_id: str) -> None:
+    """Drop the cached member list after add/remove_member."""
+    _members.pop(conversation_id, None)
+
+
+# ---------- online tracking ----------
+
+async def mark_connected(user_id: str) -> None:
+    r = config.redis_client
+    if not r:
+        return
+    try:
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.incr(_online_key(user_id))
+            pipe.expire(_online_key(user_id), config.WS_ONLINE_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        log.warning(f"[offline] mark_connected failed for {user_id}: {e}")
+
+
+async def mark_disconnected(user_id: str) -> Optional[int]:
+    """
+    Count one /ws socket of the user gone. Returns how many the user still has
+    on all workers, or None if that's unknown (no Redis, or a Redis error).
+    """
+    r = config.redis_client
+    if not r:
+        return None
+    try:
+        left = await r.decr(_online_key(user_id))
+        if left <= 0:
+            await r.delete(_online_key(user_id))
+        return max(left, 0)
+    except RedisError as e:
+        log.warning(f"[offline] mark_disconnected failed for {user_id}: {e}")
+        return None
+
+
+async def refresh_online(user_ids: Iterable[str]) -> None:
+    """Keep the online counters of users with live /ws sockets from expiring (heartbeat)."""
+    r = config.redis_client
+    user_ids = list(user_ids)
+    if not r or not user_ids:
+        return
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for uid in user_ids:
+                pipe.expire(_online_key(uid), config.WS_ONLINE_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        log.warning(f"[offline] refresh failed: {e}")
+
+
+# ---------- pending queues ----------
+
+async def enqueue_for_offline(conversation_id: str, frame: str, exclude_user_id: str = None) -> int:
+    """Append `frame` to the pending stream of every offline member. Returns how many."""
+    r = config.redis_client
+    if not r:
+        return 0
+    member_ids = [uid for uid in await _member_ids(conversation_id) if uid != exclude_user_id]
+    if not member_ids:
+        return 0
+    try:
+        online = await r.mget([_online_key(uid) for uid in member_ids])
+        offline = [uid for uid, count in zip(member_ids, online) if not count or int(count) <= 0]
+        if not offline:
+            return 0
+        async with r.pipeline(transaction=False) as pipe:
+            for uid in offline:
+                pipe.xadd(_pending_key(uid), {FIELD: frame},
+                          maxlen=config.WS_PENDING_MAXLEN, approximate=True)
+                pipe.expire(_pending_key(uid), config.WS_PENDING_TTL)
+            await pipe.execute()
+        return len(offline)
+    except RedisError as e:
+        log.warning(f"[offline] enqueue failed for {conversation_id}: {e}")
+        return 0
+
+
+async def drain(user_id: str) -> List[str]:
+    """Pop everything queued for the user, oldest first."""
+    r = config.redis_client
+    if not r:
+        return []
+    key = _pending_key(user_id)
+    try:
+        entries = await r.xrange(key, count=config.WS_PENDING_MAXLEN)
+        if entries:
+            await r.xdel(key, *[entry_id for entry_id, _ in entries])
+    except RedisError as e:
+        log.warning(f"[offline] drain failed for {user_id}: {e}")
+        return []
+    return [fields[FIELD] for _, fields in entries]
@@ -1,37 +1,58 @@
 # app/services/presence_manager.py
 from datetime import datetime
+from typing import Optional
 from redis.asyncio import Redis
 from app import config
 
 PREFIX = "presence:user"
 TTL_SECONDS = 300
 
-async def get_redis():
-    """Create a Redis client bound to the current loop."""
-    return Redis(
-        host=config.REDIS_HOST,
-        port=config.REDIS_PORT,
-        username=config.REDIS_USERNAME,
-        password=config.REDIS_PASSWORD,
-        ssl=config.REDIS_SSL,
-        decode_responses=True,
-    )
+def get_redis() -> Optional[Redis]:
+    """Shared client on the app's connection pool (created at startup)."""
+    return config.redis_client
 
 async def mark_user_active(user_id: str):
-    async with await get_redis() as r:
-        await r.set(f"{PREFIX}:{user_id}", datetime.utcnow().isoformat(), ex=TTL_SECONDS)
+    r = get_redis()
+    if not r:
+        return
+    await r.set(f"{PREFIX}:{user_id}", datetime.utcnow().isoformat(), ex=TTL_SECONDS)
 
 async def mark_user_inactive(user_id: str):
-    async with await get_redis() as r:
-        await r.delete(f"{PREFIX}:{user_id}")
+    r = get_redis()
+    if not r:
+        return
+    await r.delete(f"{PREFIX}:{user_id}")
 
 async def get_active_user_ids() -> list[str]:
     ids: list[str] = []
-    async with await get_redis() as r:
-        async for key in r.scan_iter(f"{PREFIX}:*"):
-            ids.append(key.split(":")[-1])
+    r = get_redis()
+    if not r:
+        return ids
+    async for key in r.scan_iter(f"{PREFIX}:*"):
+        ids.append(key.split(":")[-1])
     return ids
 
 async def is_user_active(user_id: str) -> bool:
-    async with await get_redis() as r:
-        return await r.exists(f"{PREFIX}:{user_id}") == 1
\ No newline at end of file
+    r = get_redis()
+    if not r:
+        return False
+    return await r.exists(f"{PREFIX}:{user_id}") == 1
+
+async def get_active_flags(user_ids: list[str]) -> dict[str, bool]:
+    """Presence for many users in one round trip (single MGET)."""
+    r = get_redis()
+    if not user_ids or not r:
+        return {uid: False for uid in user_ids}
+    values = await r.mget([f"{PREFIX}:{uid}" for uid in user_ids])
+    return {uid: value is not None for uid, value in zip(user_ids, values)}
+
+async def refresh_users(user_ids: list[str]):
+    """Mark many users active in one round trip (WebSocket heartbeat)."""
+    r = get_redis()
+    if not user_ids or not r:
+        return
+    now = datetime.utcnow().isoformat()
+    async with r.pipeline(transaction=False) as pipe:
+        for uid in user_ids:
+            pipe.set(f"{PREFIX}:{uid}", now, ex=TTL_SECONDS)
+        await pipe.execute()
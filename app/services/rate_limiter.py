@@ -0,0 +1,92 @@
+# app/services/rate_limiter.py
+"""
+Token-bucket rate limits for chat sends over WebSocket.
+
+Two layers, both must allow a message:
+  - per connection: an in-process TokenBucket on the socket (no I/O);
+  - per user, across workers and sockets: the same algorithm in Redis,
+
+      ratelimit:ws:<user_id> → HASH {tokens, ts}
+
+    updated atomically by a Lua script. Without Redis (or on a Redis error)
+    only the per-connection limit applies.
+
+A refused send reports how long until a token is available, so the caller
+can tell the client and hold off reading from the socket.
+"""
+import logging
+import time
+
+from redis.exceptions import RedisError
+
+from app import config
+
+log = logging.getLogger("uvicorn.error")
+
+PREFIX = "ratelimit:ws"
+
+# KEYS[1] bucket; ARGV: rate (tokens/s), capacity, now (ms).
+# Returns 0 if a token was taken, otherwise ms until one is available.
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class TokenBucket:
+    """In-process token bucket: `rate` tokens per second, bursts up to `capacity`."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take one token. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self) -> None:
+        """Return a token taken for a send that another limit then refused."""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+def connection_bucket() -> TokenBucket:
+    return TokenBucket(config.WS_RATE_PER_CONNECTION, config.WS_BURST_PER_CONNECTION)
+
+
+async def take_user_token(user_id: str) -> float:
+    """Cross-worker per-user limit. Returns 0 on success, else seconds to wait."""
+    r = config.redis_client
+    if not r:
+        return 0.0
+    try:
+        wait_ms = await r.eval(
+            _TAKE_SCRIPT, 1, f"{PREFIX}:{user_id}",
+            config.WS_RATE_PER_USER, config.WS_BURST_PER_USER, int(time.time() * 1000),
+        )
+    except RedisError as e:
+        log.warning(f"[ratelimit] Redis check failed for {user_id}, allowing: {e}")
+        return 0.0
+    return int(wait_ms) / 1000
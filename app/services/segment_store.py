@@ -0,0 +1,99 @@
+# app/services/segment_store.py
+"""
+Append-only storage for archived message segments.
+
+A segment is the gzip-compressed NDJSON of one sealed MessageBucket (one
+MessageResponse per line, seq order). Objects are written once under a
+unique key and never modified; the MessageSegment node in Neo4j points at
+the key that was committed.
+
+Backends: S3 (ARCHIVE_BACKEND=s3) or a local directory stand-in (default).
+"""
+import gzip
+import os
+from functools import lru_cache
+from typing import List
+from uuid import uuid4
+
+import boto3
+
+from app import config
+from app.schemas.message import MessageResponse
+
+
+class LocalSegmentStore:
+    """Segments as files under ARCHIVE_LOCAL_DIR (dev / tests / single host)."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def put(self, key: str, data: bytes) -> None:
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "xb") as fh:          # "x" → never overwrite
+            fh.write(data)
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.root, key), "rb") as fh:
+            return fh.read()
+
+
+class S3SegmentStore:
+    """Segments as objects in ARCHIVE_S3_BUCKET under ARCHIVE_S3_PREFIX."""
+
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.s3 = boto3.client(
+            "s3",
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("AWS_REGION"),
+        )
+
+    def put(self, key: str, data: bytes) -> None:
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}/{key}",
+            Body=data,
+            ContentType="application/x-ndjson",
+            ContentEncoding="gzip",
+        )
+
+    def get(self, key: str) -> bytes:
+        obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}")
+        return obj["Body"].read()
+
+
+@lru_cache(maxsize=1)
+def get_store():
+    """Return the configured segment store (created once per process)."""
+    if config.ARCHIVE_BACKEND == "s3":
+        if not config.ARCHIVE_S3_BUCKET:
+            raise RuntimeError("ARCHIVE_BACKEND=s3 but no ARCHIVE_S3_BUCKET / AWS_BUCKET_NAME set")
+        return S3SegmentStore(config.ARCHIVE_S3_BUCKET, config.ARCHIVE_S3_PREFIX)
+    return LocalSegmentStore(config.ARCHIVE_LOCAL_DIR)
+
+
+def new_segment_key(conversation_id: str, index: int) -> str:
+    """Unique key per write attempt, so a retried archival never overwrites."""
+    return f"{conversation_id}/{index:08d}-{uuid4().hex}.ndjson.gz"
+
+
+def write_segment(key: str, messages: List[MessageResponse]) -> int:
+    """Compress and store a segment; returns its size in bytes."""
+    body = "".join(m.model_dump_json() + "\n" for m in messages).encode("utf-8")
+    data = gzip.compress(body)
+    get_store().put(key, data)
+    return len(data)
+
+
+@lru_cache(maxsize=config.ARCHIVE_SEGMENT_CACHE_SIZE)
+def _read_lines(key: str) -> tuple:
+    # Segments are immutable, so caching decoded lines by key is always safe.
+    return tuple(gzip.decompress(get_store().get(key)).decode("utf-8").splitlines())
+
+
+def read_segment(key: str) -> List[MessageResponse]:
+    """Load every message of a segment (seq order)."""
+    return [MessageResponse.model_validate_json(line) for line in _read_lines(key) if line]
@@ -1,45 +1,622 @@
-from typing import Dict, List
-from fastapi import WebSocket
+"""
+Tracks WebSocket connections per conversation and fans messages out to them.
+
+Connections are conversation-bound (/ws/conversations/{id}) or multiplexed
+(/ws, every conversation of the user plus their personal channel). With Redis,
+broadcasts go through pub/sub so every worker delivers to its own sockets.
+Each socket has a bounded outbound queue and writer task, so a slow client
+can't hold up the rest. Protocol and tuning knobs: ARCHITECTURE.md,
+"Real-time Chat (WebSocket)".
+"""
 import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket, status
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+from redis.exceptions import RedisError
+
+from app import config
+from app.services import offline_queue, presence_manager
+from app.services.rate_limiter import connection_bucket
+
+try:  # optional: binary MessagePack frames (?encoding=msgpack)
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger("uvicorn.error")
+
+CHANNEL_PREFIX = "ws:conversation:"
+USER_CHANNEL_PREFIX = "ws:user:"
+CONTROL_CHANNEL = "ws:control"
+MESSAGE = "message"
+RETRY_DELAY = 1.0         # back-off after a broker error
+POLL_TIMEOUT = 1.0
+CLOSE_TIMEOUT = 5.0       # don't let a stuck client hold an eviction forever
+WS_CLOSE_SERVICE_RESTART = 1012
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+EVENT_THROTTLE_RETENTION = 60.0   # forget per-user event timestamps older than this
+
+
+def _channel(conversation_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{conversation_id}"
+
+
+def _user_channel(user_id: str) -> str:
+    return f"{USER_CHANNEL_PREFIX}{user_id}"
+
+
+def decode_frame(data: Union[str, bytes]) -> object:
+    """Inbound payload: JSON text, or MessagePack bytes."""
+    if isinstance(data, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("MessagePack frames are not supported on this server")
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+
+def encode_frame(message: Union[dict, str]) -> str:
+    """JSON text frame for a payload; already-encoded frames pass through."""
+    if isinstance(message, str):
+        return message
+    return json.dumps(message, separators=(",", ":"))
+
+
+class Frame:
+    """An outbound frame shared by every socket it is queued for."""
+    __slots__ = ("text", "_packed")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._packed: Optional[bytes] = None
+
+    def packed(self) -> bytes:
+        """MessagePack encoding of the same payload, computed on first use."""
+        if self._packed is None:
+            self._packed = msgpack.packb(json.loads(self.text))
+        return self._packed
+
+
+PING_FRAME = Frame('{"type":"ping"}')
+
+
+class Connection:
+    """
+    One accepted socket with its bounded outbound queue and writer task.
+    Hashed by identity, so it can live in the registry's sets.
+    """
+    __slots__ = (
+        "websocket", "user_id", "connected_at", "multiplexed", "binary", "kinds",
+        "conversations", "is_member", "queue", "writer", "dropped", "closed",
+        "heartbeat", "last_seen", "send_bucket", "online_left",
+    )
+
+    def __init__(self, websocket: WebSocket, user_id: str,
+                 multiplexed: bool = False, kinds: Iterable[str] = (), binary: bool = False,
+                 heartbeat: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.connected_at = datetime.utcnow()
+        self.multiplexed = multiplexed
+        self.binary = binary and msgpack is not None    # MessagePack instead of JSON text
+        self.kinds: Set[str] = {MESSAGE, *kinds}    # frame kinds this socket receives
+        self.conversations: Set[str] = set()
+        self.is_member = True             # cached at handshake, see invalidate_membership
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=config.WS_SEND_QUEUE_SIZE)   # of Frame
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+        self.heartbeat = heartbeat            # answers {"type": "ping"}; reaped when silent
+        self.last_seen = time.monotonic()     # last inbound frame, see touch()
+        self.send_bucket = connection_bucket()   # per-connection chat send limit
+        self.online_left: Optional[int] = None   # user's /ws sockets on all workers after this one closed
 
 
 class ConnectionManager:
     """
-    Tracks active websocket connections by conversation_id.
-    {"<conversation_id>": [list of sockets]}
+    Registry of this worker's connections:
+      active_connections  {"<conversation_id>": {Connection, ...}}
+      user_connections    {"<user_id>": {Connection, ...}}
+    Connect, disconnect and join/leave are O(1) set operations per index.
+    Deliveries iterate an immutable per-conversation snapshot (rebuilt only
+    after the room changes), so the registry can change underneath a delivery
+    or an await without "set changed size during iteration". All mutation
+    happens on the event loop; threads go through send_to_user_threadsafe.
     """
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.active_connections: Dict[str, Set[Connection]] = {}
+        self.user_connections: Dict[str, Set[Connection]] = {}
+        self._connections: Set[Connection] = set()
+        self._snapshots: Dict[str, Tuple[Connection, ...]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._redis: Optional[Redis] = None
+        self._pubsub: Optional[PubSub] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        self._coalescing: Dict[str, list] = {}        # conversation_id → texts awaiting flush
+        self.draining = False                         # set on shutdown: refuse new sockets
+        self.dropped_total = 0
+        self.evicted_total = 0
+        self.reaped_total = 0
+        self.throttled_total = 0
+        self.rate_limited_total = 0
+        self._event_times: Dict[tuple, float] = {}    # (user_id, conversation_id, kind) → last relay
+
+    # ---------- lifecycle ----------
+
+    async def start(self, redis: Optional[Redis]) -> None:
+        """
+        Start the heartbeat and, with Redis, switch to broker mode and start
+        the pub/sub listener (app startup).
+        """
+        self._loop = asyncio.get_running_loop()
+        self._heartbeat = asyncio.create_task(self._run_heartbeat())
+        if not config.WS_BROKER_ENABLED or redis is None:
+            log.info("[WS] Broker disabled, broadcasting to local sockets only.")
+            return
+        self._redis = redis
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(CONTROL_CHANNEL)
+        for conversation_id in list(self.active_connections):
+            await self._subscribe(_channel(conversation_id))
+        for user_id in list(self.user_connections):
+            if self._hosted(_user_channel(user_id)):
+                await self._subscribe(_user_channel(user_id))
+        self._listener = asyncio.create_task(self._listen())
+        log.info("[WS] Redis pub/sub broker started.")
+
+    async def stop(self) -> None:
+        """Stop the background tasks and drop the subscriptions (app shutdown)."""
+        for task in (self._heartbeat, self._listener):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._heartbeat = None
+        self._listener = None
+        if self._pubsub:
+            try:
+                await self._pubsub.aclose()
+            except RedisError:
+                pass
+        self._pubsub = None
+        self._redis = None
+
+    async def drain(self) -> None:
+        """
+        Refuse new sockets, ask every client to reconnect after a jittered
+        delay, let the queued frames go out, then close (app shutdown, before stop).
+        """
+        self.draining = True
+        if self._background:      # coalesced large-room messages still being flushed
+            await asyncio.wait(tuple(self._background), timeout=CLOSE_TIMEOUT)
+        conns = self._all_connections()
+        if not conns:
+            return
+        log.info(f"[WS] Draining {len(conns)} socket(s).")
+        await asyncio.gather(*(self._drain_one(conn) for conn in conns))
+
+    async def _drain_one(self, conn: Connection) -> None:
+        delay = random.uniform(config.WS_RECONNECT_MIN_DELAY, config.WS_RECONNECT_MAX_DELAY)
+        self._offer(conn, Frame(encode_frame({"type": "reconnect", "retry_after": round(delay, 2)})))
+        try:
+            await asyncio.wait_for(conn.queue.join(), config.WS_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        await self._close(conn, WS_CLOSE_SERVICE_RESTART, "Server restarting")
+
+    def _hosted(self, channel: str) -> bool:
+        """Whether this worker still has sockets listening on the channel."""
+        if channel.startswith(USER_CHANNEL_PREFIX):
+            user_id = channel[len(USER_CHANNEL_PREFIX):]
+            return any(conn.multiplexed for conn in self.user_connections.get(user_id, ()))
+        return channel[len(CHANNEL_PREFIX):] in self.active_connections
+
+    async def _subscribe(self, channel: str) -> None:
+        if not self._pubsub:
+            return
+        try:
+            await self._pubsub.subscribe(channel)
+        except RedisError as e:
+            log.warning(f"[WS] subscribe failed for {channel}: {e}")
+
+    async def _unsubscribe(self, channel: str) -> None:
+        if not self._pubsub or self._hosted(channel):
+            return
+        try:
+            await self._pubsub.unsubscribe(channel)
+        except RedisError as e:
+            log.warning(f"[WS] unsubscribe failed for {channel}: {e}")
+        # A socket may have joined while the UNSUBSCRIBE was in flight.
+        if self._hosted(channel):
+            await self._subscribe(channel)
+
+    async def _listen(self) -> None:
+        """Deliver messages published by any worker to the local sockets."""
+        while True:
+            try:
+                event = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=POLL_TIMEOUT
+                )
+            except asyncio.CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                log.warning(f"[WS] broker read failed: {e}")
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            if not event or event.get("type") != "message":
+                continue
+
+            channel = event["channel"]
+            if channel != CONTROL_CHANNEL:
+                # Already an encoded frame: forward without re-parsing.
+                kind, _, frame = event["data"].partition("|")
+                if channel.startswith(USER_CHANNEL_PREFIX):
+                    self._deliver_user(channel[len(USER_CHANNEL_PREFIX):], frame, kind)
+                else:
+                    self._deliver(channel[len(CHANNEL_PREFIX):], frame, kind)
+                continue
+            try:
+                control = json.loads(event["data"])
+            except ValueError:
+                log.warning("[WS] dropped malformed control message")
+                continue
+            await self._apply_control(control)
 
-    async def connect(self, conversation_id: str, websocket: WebSocket):
+    # ---------- membership ----------
+
+    async def invalidate_membership(self, conversation_id: str, user_id: str, is_member: bool):
+        """
+        Update the membership cached on the user's sockets for a conversation,
+        on every worker. Conversation-bound sockets of a removed member are
+        closed; multiplexed sockets join or leave the conversation.
+        """
+        control = {
+            "type": "membership",
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "is_member": is_member,
+        }
+        if self._redis is not None:
+            try:
+                await self._redis.publish(CONTROL_CHANNEL, json.dumps(control))
+                return
+            except RedisError as e:
+                log.warning(f"[WS] control publish failed, applying locally: {e}")
+        await self._apply_control(control)
+
+    async def _apply_control(self, control: dict):
+        if control.get("type") != "membership":
+            return
+        conversation_id = control["conversation_id"]
+        user_id = control["user_id"]
+        is_member = control["is_member"]
+        offline_queue.forget_members(conversation_id)
+
+        for conn in tuple(self.user_connections.get(user_id, ())):
+            if conn.multiplexed:
+                if is_member and conversation_id not in conn.conversations:
+                    await self._join(conn, conversation_id)
+                    self.send(conn, {"type": "conversation_added", "conversation_id": conversation_id})
+                elif not is_member and conversation_id in conn.conversations:
+                    await self._leave(conn, conversation_id)
+                    self.send(conn, {"type": "conversation_removed", "conversation_id": conversation_id})
+            elif conversation_id in conn.conversations:
+                conn.is_member = is_member
+                if not is_member:
+                    await self._close(conn, status.WS_1008_POLICY_VIOLATION, "Removed from conversation")
+
+    # ---------- local sockets ----------
+
+    async def connect(self, websocket: WebSocket, user_id: str,
+                      conversation_ids: Iterable[str],
+                      multiplexed: bool = False, kinds: Iterable[str] = (),
+                      binary: bool = False, heartbeat: bool = False) -> Connection:
+        """
+        Accept a socket whose user was already authorized for the conversations.
+        `kinds` are the extra frame kinds (besides chat messages) it wants;
+        `binary` asks for MessagePack frames (ignored if msgpack isn't installed);
+        `heartbeat` opts in to application-level pings and idle reaping.
+        """
         await websocket.accept()
-        if conversation_id not in self.active_connections:
-            self.active_connections[conversation_id] = []
-        self.active_connections[conversation_id].append(websocket)
-        print(f"[WS] Connected → conversation {conversation_id}, total: {len(self.active_connections[conversation_id])}")
-
-    def disconnect(self, conversation_id: str, websocket: WebSocket):
-        if conversation_id in self.active_connections:
-            self.active_connections[conversation_id].remove(websocket)
-            if not self.active_connections[conversation_id]:
-                del self.active_connections[conversation_id]
-            print(f"[WS] Disconnected → conversation {conversation_id}")
-
-    async def broadcast(self, conversation_id: str, message: dict):
-        """
-        Send JSON message to all clients in a conversation.
-        Safely skip broken connections.
-        """
-        connections = self.active_connections.get(conversation_id, [])
-        dead = []
-        for ws in connections:
+        self._loop = asyncio.get_running_loop()
+        conn = Connection(websocket, user_id, multiplexed, kinds, binary, heartbeat)
+        conn.writer = asyncio.create_task(self._write(conn))
+        self._connections.add(conn)
+        sockets = self.user_connections.setdefault(user_id, set())
+        first_multiplexed = multiplexed and not any(c.multiplexed for c in sockets)
+        sockets.add(conn)
+        for conversation_id in conversation_ids:
+            await self._join(conn, conversation_id)
+        if first_multiplexed:
+            await self._subscribe(_user_channel(user_id))
+        if multiplexed:
+            await offline_queue.mark_connected(user_id)
+        print(f"[WS] Connected → user {user_id}, conversations: {len(conn.conversations)}")
+        return conn
+
+    async def disconnect(self, conn: Connection):
+        """Forget the connection and stop its writer (idempotent)."""
+        if conn.closed:
+            return
+        conn.closed = True
+        if conn.writer and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+        self._connections.discard(conn)
+        sockets = self.user_connections.get(conn.user_id)
+        if sockets is not None:
+            sockets.discard(conn)
+            if not sockets:
+                del self.user_connections[conn.user_id]
+        for conversation_id in tuple(conn.conversations):
+            await self._leave(conn, conversation_id)
+        if conn.multiplexed:
+            await self._unsubscribe(_user_channel(conn.user_id))
+            conn.online_left = await offline_queue.mark_disconnected(conn.user_id)
+        print(f"[WS] Disconnected → user {conn.user_id}")
+
+    async def _join(self, conn: Connection, conversation_id: str) -> None:
+        conn.conversations.add(conversation_id)
+        room = self.active_connections.setdefault(conversation_id, set())
+        room.add(conn)
+        self._snapshots.pop(conversation_id, None)
+        if len(room) == 1:
+            await self._subscribe(_channel(conversation_id))
+
+    async def _leave(self, conn: Connection, conversation_id: str) -> None:
+        conn.conversations.discard(conversation_id)
+        room = self.active_connections.get(conversation_id)
+        if room is None or conn not in room:
+            return
+        room.discard(conn)
+        self._snapshots.pop(conversation_id, None)
+        if not room:
+            del self.active_connections[conversation_id]
+            await self._unsubscribe(_channel(conversation_id))
+
+    def room_snapshot(self, conversation_id: str) -> Tuple[Connection, ...]:
+        """This worker's connections in a conversation, as an immutable tuple."""
+        snapshot = self._snapshots.get(conversation_id)
+        if snapshot is None:
+            snapshot = tuple(self.active_connections.get(conversation_id, ()))
+            if snapshot:
+                self._snapshots[conversation_id] = snapshot
+        return snapshot
+
+    def send(self, conn: Connection, message: Union[dict, str]) -> None:
+        """Queue a frame for one connection (replies to the sender, errors)."""
+        self._offer(conn, Frame(encode_frame(message)))
+
+    async def broadcast(self, conversation_id: str, message: Union[dict, str], kind: str = MESSAGE):
+        """
+        Send a frame to all clients in a conversation, on every worker.
+        `message` is a JSON-able dict or an already-encoded JSON string; either
+        way it is encoded once for the bus and all local sockets.
+        Falls back to local delivery if the broker is unavailable.
+        """
+        frame = encode_frame(message)
+        if await self._publish(_channel(conversation_id), frame, kind):
+            return
+        self._deliver(conversation_id, frame, kind)
+
+    async def send_to_user(self, user_id: str, message: Union[dict, str], kind: str):
+        """Send a frame to the user's multiplexed sockets, on every worker."""
+        frame = encode_frame(message)
+        if await self._publish(_user_channel(user_id), frame, kind):
+            return
+        self._deliver_user(user_id, frame, kind)
+
+    def send_to_user_threadsafe(self, user_id: str, message: Union[dict, str], kind: str) -> None:
+        """send_to_user for sync code running in a worker thread; fire-and-forget."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.send_to_user(user_id, message, kind), self._loop)
+
+    async def _publish(self, channel: str, frame: str, kind: str) -> bool:
+        if self._redis is None:
+            return False
+        try:
+            await self._redis.publish(channel, f"{kind}|{frame}")
+            return True
+        except RedisError as e:
+            log.warning(f"[WS] publish failed on {channel}, delivering locally: {e}")
+            return False
+
+    def _deliver(self, conversation_id: str, text: str, kind: str = MESSAGE):
+        """Queue a frame for this worker's clients in a conversation; never blocks."""
+        room = self.room_snapshot(conversation_id)
+        if kind == MESSAGE and len(room) >= config.WS_LARGE_ROOM_SIZE:
+            self._coalesce(conversation_id, text)
+            return
+        frame = Frame(text)
+        for conn in room:
+            if kind in conn.kinds:
+                self._offer(conn, frame)
+
+    # ---------- large rooms ----------
+
+    def _coalesce(self, conversation_id: str, text: str) -> None:
+        pending = self._coalescing.get(conversation_id)
+        if pending is not None:
+            pending.append(text)
+            return
+        self._coalescing[conversation_id] = [text]
+        self._spawn(self._flush_large_room(conversation_id))
+
+    async def _flush_large_room(self, conversation_id: str) -> None:
+        """After the coalescing window, fan the buffered messages out in shards."""
+        await asyncio.sleep(config.WS_COALESCE_WINDOW_MS / 1000)
+        texts = self._coalescing.pop(conversation_id, [])
+        if not texts:
+            return
+        singles = [Frame(text) for text in texts]
+        batch = singles[0] if len(texts) == 1 else Frame(
+            '{"type":"batch","conversation_id":%s,"messages":[%s]}'
+            % (json.dumps(conversation_id), ",".join(texts))
+        )
+        room = self.room_snapshot(conversation_id)
+        shard = config.WS_FANOUT_SHARD_SIZE
+        for start in range(0, len(room), shard):
+            for conn in room[start:start + shard]:
+                if conn.multiplexed:
+                    self._offer(conn, batch)
+                else:
+                    for frame in singles:
+                        self._offer(conn, frame)
+            await asyncio.sleep(0)
+
+    def _deliver_user(self, user_id: str, text: str, kind: str):
+        frame = Frame(text)
+        for conn in tuple(self.user_connections.get(user_id, ())):
+            if kind in conn.kinds:
+                self._offer(conn, frame)
+
+    # ---------- ephemeral events ----------
+
+    def allow_event(self, user_id: str, conversation_id: str, kind: str, interval: float) -> bool:
+        """Per-user throttle for relayed events (typing, read-acks) on this worker."""
+        key = (user_id, conversation_id, kind)
+        now = time.monotonic()
+        last = self._event_times.get(key)
+        if last is not None and now - last < interval:
+            self.throttled_total += 1
+            return False
+        self._event_times[key] = now
+        return True
+
+    # ---------- heartbeat ----------
+
+    def touch(self, conn: Connection) -> None:
+        """Record inbound activity (any frame, including pong) on a connection."""
+        conn.last_seen = time.monotonic()
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(config.WS_PING_INTERVAL)
             try:
-                await ws.send_json(message)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(conversation_id, ws)
+                await self._heartbeat_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"[WS] heartbeat failed: {e}")
+
+    async def _heartbeat_once(self) -> None:
+        """Ping opted-in sockets, reap idle ones, refresh presence for connected users."""
+        deadline = time.monotonic() - config.WS_IDLE_TIMEOUT
+        online: Set[str] = set()
+        multiplexed: Set[str] = set()
+        for conn in self._all_connections():
+            if conn.heartbeat and conn.last_seen < deadline:
+                self.reaped_total += 1
+                log.info(f"[WS] Reaping idle socket of user {conn.user_id}")
+                self._spawn_close(conn, status.WS_1001_GOING_AWAY, "Idle timeout")
+                continue
+            online.add(conn.user_id)
+            if conn.multiplexed:
+                multiplexed.add(conn.user_id)
+            if conn.heartbeat:
+                self._offer(conn, PING_FRAME)
+        cutoff = time.monotonic() - EVENT_THROTTLE_RETENTION
+        self._event_times = {k: t for k, t in self._event_times.items() if t > cutoff}
+        if online:
+            await presence_manager.refresh_users(list(online))
+        await offline_queue.refresh_online(multiplexed)
+
+    def _all_connections(self) -> Tuple[Connection, ...]:
+        return tuple(self._connections)
+
+    # ---------- outbound queues ----------
+
+    def _offer(self, conn: Connection, frame: Frame) -> None:
+        if conn.closed:
+            return
+        try:
+            conn.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        if config.WS_SLOW_CONSUMER_POLICY == "drop_oldest":
+            conn.queue.get_nowait()
+            conn.queue.task_done()
+            conn.queue.put_nowait(frame)
+            conn.dropped += 1
+            self.dropped_total += 1
+        else:
+            self._evict(conn)
+
+    def _evict(self, conn: Connection) -> None:
+        """Close a consumer that can't keep up, without waiting for it here."""
+        self.evicted_total += 1
+        log.warning(f"[WS] Slow consumer {conn.user_id} evicted ({conn.queue.qsize()} frames queued)")
+        self._spawn_close(conn, WS_CLOSE_TRY_AGAIN_LATER, "Slow consumer")
+
+    def _spawn_close(self, conn: Connection, code: int, reason: str) -> None:
+        self._spawn(self._close(conn, code, reason))
+
+    def _spawn(self, coro) -> None:
+        """Run a coroutine in the background, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _close(self, conn: Connection, code: int, reason: str) -> None:
+        await self.disconnect(conn)
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=code, reason=reason), CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _write(self, conn: Connection) -> None:
+        """Writer task: drain the connection's queue onto the socket, in order."""
+        try:
+            while True:
+                frame = await conn.queue.get()
+                try:
+                    if conn.binary:
+                        await conn.websocket.send_bytes(frame.packed())
+                    else:
+                        await conn.websocket.send_text(frame.text)
+                finally:
+                    conn.queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Broken socket: drop it, the receive loop will notice the close.
+            await self.disconnect(conn)
+
+    def metrics(self) -> dict:
+        """Snapshot of this worker's connections and outbound queue depths."""
+        conns = self._all_connections()
+        depths = [conn.queue.qsize() for conn in conns]
+        return {
+            "connections": len(conns),
+            "conversations": len(self.active_connections),
+            "users": len(self.user_connections),
+            "large_rooms": sum(1 for room in self.active_connections.values()
+                               if len(room) >= config.WS_LARGE_ROOM_SIZE),
+            "broker": self._redis is not None,
+            "draining": self.draining,
+            "queue_capacity": config.WS_SEND_QUEUE_SIZE,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "full_queues": sum(1 for d in depths if d >= config.WS_SEND_QUEUE_SIZE),
+            "slow_consumer_policy": config.WS_SLOW_CONSUMER_POLICY,
+            "dropped_messages": self.dropped_total,
+            "evicted_connections": self.evicted_total,
+            "reaped_idle_connections": self.reaped_total,
+            "throttled_events": self.throttled_total,
+            "rate_limited_sends": self.rate_limited_total,
+        }
 
 
 # Singleton instance
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
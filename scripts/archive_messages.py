@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Archive old message history into compressed cold-storage segments.
+
+Every sealed MessageBucket whose newest message is older than the threshold
+is written as a gzip NDJSON segment (S3 or ARCHIVE_LOCAL_DIR, see
+ARCHIVE_BACKEND) and replaced in Neo4j by a small MessageSegment index node.
+History paging reads archived ranges back from the segments. Safe to run on
+a schedule (e.g. nightly cron):
+
+    python -m scripts.archive_messages [--older-than-days 180] [--max-buckets 500]
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from app.config import ARCHIVE_AFTER_DAYS
+from app.crud.message import message_crud
+
+BATCH = 50  # buckets per lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old message history")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--max-buckets", type=int, default=500)
+    args = parser.parse_args()
+
+    cutoff = datetime.utcnow() - timedelta(days=args.older_than_days)
+    archived = skipped = 0
+    while archived < args.max_buckets:
+        bucket_ids = message_crud.find_archivable_buckets(
+            cutoff, limit=min(BATCH, args.max_buckets - archived)
+        )
+        progress = False
+        for bucket_id in bucket_ids:
+            segment = message_crud.archive_bucket(bucket_id)
+            if segment:
+                archived += 1
+                progress = True
+                print(f"[ℹ️] {bucket_id} → {segment.storage_key} ({segment.size_bytes} bytes)")
+            else:
+                skipped += 1
+                print(f"[⚠️] {bucket_id} changed while archiving; left for the next run")
+        if not progress:
+            break   # nothing left, or only contended buckets
+
+    print(f"✅ Archived {archived} bucket(s), skipped {skipped}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
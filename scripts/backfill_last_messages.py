@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+One-off backfill of Conversation.last_message_id / last_message_at.
+
+Conversations created before the inbox query existed have no last-message
+pointer, so they show no preview and sort last until their next message.
+Run once after deploying:
+
+    python -m scripts.backfill_last_messages
+"""
+
+import sys
+
+from neomodel import db
+
+from app.crud.conversation import conversation_crud
+
+
+def main():
+    results, _ = db.cypher_query(
+        "MATCH (c:Conversation) WHERE c.last_message_id IS NULL RETURN c.conversation_id"
+    )
+    for (conversation_id,) in results:
+        conversation_crud.refresh_last_message(conversation_id)
+    print(f"✅ Backfilled {len(results)} conversation(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+One-off backfill for per-conversation sequence numbers.
+
+Messages sent before sequence numbers existed have no `seq` / `conversation_id`
+and memberships have no `last_read_seq`. Old history comes first, so this
+script gives those messages seq 1…n in timestamp order and shifts everything
+already numbered since the deploy (messages, tombstones, read pointers,
+Conversation.message_seq) up by n, all in one transaction per conversation.
+Shifted messages are detached from their buckets and handed back to the
+bucket migration, which files them under their new seq. Each member's missing
+last_read_seq is derived from their last_read_at (members without a pointer
+start with the history marked read).
+Run once, right after deploying, and run the bucket migration straight after:
+
+    python -m scripts.backfill_message_seq
+    python -m scripts.migrate_message_buckets
+
+Clients may see messages sent since the deploy again under their new seq
+(dedupe by message_id); clear the chat:recent:* cache keys afterwards.
+Conversations that already have archived segments are skipped and reported.
+"""
+
+import sys
+
+from app.config import db   # neomodel, connected to the app's database
+
+COUNT_UNNUMBERED = """
+MATCH (c:Conversation {conversation_id: $cid})<-[:IN_CONVERSATION]-(m:Message)
+WHERE m.seq IS NULL
+RETURN count(m), EXISTS { (c)-[:HAS_SEGMENT]->(:MessageSegment) }
+"""
+
+# Make room for the old history below everything numbered since the deploy.
+SHIFT_NUMBERED = """
+MATCH (c:Conversation {conversation_id: $cid})
+SET c.message_seq = coalesce(c.message_seq, 0) + $shift,
+    c.change_seq = coalesce(c.change_seq, 0)
+WITH c
+CALL {
+    WITH c
+    MATCH (m:Message {conversation_id: c.conversation_id})
+    WHERE m.seq IS NOT NULL
+    SET m.seq = m.seq + $shift
+    MERGE (m)-[:IN_CONVERSATION]->(c)
+}
+CALL {
+    WITH c
+    MATCH (t:MessageTombstone {conversation_id: c.conversation_id})
+    WHERE t.seq IS NOT NULL
+    SET t.seq = t.seq + $shift
+}
+CALL {
+    WITH c
+    MATCH (c)<-[r:MEMBER_OF]-(:User)
+    WHERE r.last_read_seq IS NOT NULL
+    SET r.last_read_seq = r.last_read_seq + $shift
+}
+CALL {
+    WITH c
+    MATCH (c)-[:HAS_BUCKET]->(b:MessageBucket)
+    DETACH DELETE b
+}
+"""
+
+NUMBER_MESSAGES = """
+MATCH (c:Conversation {conversation_id: $cid})<-[:IN_CONVERSATION]-(m:Message)
+WHERE m.seq IS NULL
+WITH c, m ORDER BY m.timestamp
+WITH c, collect(m) AS pending
+FOREACH (i IN range(0, size(pending) - 1) |
+    SET (pending[i]).seq = i + 1,
+        (pending[i]).conversation_id = c.conversation_id
+)
+"""
+
+BACKFILL_POINTERS = """
+MATCH (c:Conversation {conversation_id: $cid})<-[r:MEMBER_OF]-(:User)
+WHERE r.last_read_seq IS NULL
+SET r.last_read_seq = CASE
+    WHEN r.last_read_at IS NULL THEN coalesce(c.message_seq, 0)
+    ELSE coalesce(head(COLLECT {
+        MATCH (c)<-[:IN_CONVERSATION]-(m:Message)
+        WHERE m.timestamp <= r.last_read_at
+        RETURN m.seq ORDER BY m.seq DESC LIMIT 1
+    }), 0)
+END
+"""
+
+
+def main():
+    conversations, _ = db.cypher_query("MATCH (c:Conversation) RETURN c.conversation_id")
+    numbered = 0
+    skipped = []
+    for (cid,) in conversations:
+        results, _ = db.cypher_query(COUNT_UNNUMBERED, {"cid": cid})
+        pending, archived = results[0] if results else (0, False)
+        if pending and archived:
+            skipped.append(cid)
+            continue
+        with db.transaction:
+            if pending:
+                db.cypher_query(SHIFT_NUMBERED, {"cid": cid, "shift": pending})
+                db.cypher_query(NUMBER_MESSAGES, {"cid": cid})
+            db.cypher_query(BACKFILL_POINTERS, {"cid": cid})
+        numbered += pending
+    print(f"✅ Numbered {numbered} message(s) across {len(conversations)} conversation(s)")
+    for cid in skipped:
+        print(f"❌ {cid} has archived segments; renumber it by hand")
+    return 1 if skipped else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Presence lookup benchmark: a new Redis client per call (how presence_manager
+used to work) vs one client on a shared connection pool (how it works now).
+
+Runs the same EXISTS presence:user:<id> check sequentially and with
+CONCURRENCY calls in flight, and reports per-call latency (p50 / p95 / max)
+and throughput. Needs the app's Redis settings (.env); app.config also
+connects to Neo4j at import:
+
+    python -m scripts.bench_presence_redis
+"""
+
+import asyncio
+import sys
+import time
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.connection import Connection, SSLConnection
+
+from app import config
+from app.services.presence_manager import PREFIX
+
+CALLS = 200
+CONCURRENCY = 20
+
+
+def _settings():
+    return dict(
+        host=config.REDIS_HOST, port=config.REDIS_PORT,
+        username=config.REDIS_USERNAME, password=config.REDIS_PASSWORD,
+        decode_responses=True,
+    )
+
+
+async def _per_call(user_id: str) -> bool:
+    async with Redis(ssl=config.REDIS_SSL, **_settings()) as r:
+        return await r.exists(f"{PREFIX}:{user_id}") == 1
+
+
+def _pooled(client: Redis):
+    async def check(user_id: str) -> bool:
+        return await client.exists(f"{PREFIX}:{user_id}") == 1
+    return check
+
+
+async def _measure(check, concurrency: int) -> tuple:
+    """Run CALLS checks, `concurrency` at a time; return (latencies in ms, wall seconds)."""
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with gate:
+            started = time.perf_counter()
+            await check(f"bench-{i}")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(CALLS)))
+    return sorted(latencies), time.perf_counter() - started
+
+
+async def _bench():
+    pool = BlockingConnectionPool(
+        connection_class=SSLConnection if config.REDIS_SSL else Connection,
+        max_connections=config.REDIS_MAX_CONNECTIONS, timeout=config.REDIS_POOL_TIMEOUT,
+        **_settings(),
+    )
+    client = Redis(connection_pool=pool)
+    await client.ping()      # open the first connection outside the measurement
+
+    print(f"{CALLS} presence checks, pool of {config.REDIS_MAX_CONNECTIONS}")
+    print(f"{'client':>9} {'parallel':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'calls/s':>9}")
+    try:
+        for concurrency in (1, CONCURRENCY):
+            for name, check in (("per-call", _per_call), ("pooled", _pooled(client))):
+                latencies, wall = await _measure(check, concurrency)
+                p50 = latencies[len(latencies) // 2]
+                p95 = latencies[int(len(latencies) * 0.95)]
+                print(f"{name:>9} {concurrency:>9} {p50:>9.2f} {p95:>9.2f} "
+                      f"{latencies[-1]:>9.2f} {CALLS / wall:>9.0f}")
+    finally:
+        await client.close()
+        await pool.disconnect()
+
+
+def main():
+    asyncio.run(_bench())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Fan-out benchmark for the WebSocket manager.
+
+Connects N in-memory sockets to one conversation, sends a burst of chat
+messages through manager.broadcast and reports, per room size, how long
+members waited until they had the whole burst (p50 / p95 / p99 / max), with
+large-room coalescing on and off. No Redis is used (local delivery only),
+but app.config still connects to Neo4j at import, so run it where the app's
+.env is available:
+
+    python -m scripts.bench_ws_fanout
+"""
+
+import asyncio
+import contextlib
+import io
+import sys
+import time
+
+from app import config
+from app.services.ws_manager import manager
+
+ROOM_SIZES = (2, 50, 200, 1000, 5000)
+BURST = 20                   # messages sent back to back per round
+ROUNDS = 5
+CONVERSATION_ID = "bench-fanout"
+
+
+class FakeSocket:
+    """Stands in for a Starlette WebSocket; counts the chat messages it receives."""
+
+    def __init__(self):
+        self.received = 0
+        self.expected = 0
+        self.done = None
+        self.finished_at = 0.0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.received += text.count('"n":')
+        if self.received >= self.expected and not self.done.done():
+            self.finished_at = time.perf_counter()
+            self.done.set_result(None)
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def _run(size: int, coalesce: bool) -> list:
+    config.WS_LARGE_ROOM_SIZE = config.WS_LARGE_ROOM_SIZE if coalesce else sys.maxsize
+    sockets = [FakeSocket() for _ in range(size)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        conns = [await manager.connect(ws, f"user-{i}", [CONVERSATION_ID], multiplexed=True)
+                 for i, ws in enumerate(sockets)]
+
+    latencies = []
+    loop = asyncio.get_running_loop()
+    for _ in range(ROUNDS):
+        for ws in sockets:
+            ws.expected = ws.received + BURST
+            ws.done = loop.create_future()
+        started = time.perf_counter()
+        for n in range(BURST):
+            await manager.broadcast(CONVERSATION_ID, '{"n":%d}' % n)
+        await asyncio.gather(*(ws.done for ws in sockets))
+        latencies.extend((ws.finished_at - started) * 1000 for ws in sockets)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for conn in conns:
+            await manager.disconnect(conn)
+    return latencies
+
+
+async def _bench():
+    large_room = config.WS_LARGE_ROOM_SIZE
+    print(f"burst of {BURST} messages × {ROUNDS} rounds, large room ≥ {large_room} sockets")
+    print(f"{'sockets':>8} {'coalesce':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for size in ROOM_SIZES:
+        for coalesce in (False, True):
+            latencies = await _run(size, coalesce)
+            config.WS_LARGE_ROOM_SIZE = large_room
+            print(f"{size:>8} {'on' if coalesce else 'off':>9} "
+                  f"{_percentile(latencies, 50):>9.2f} {_percentile(latencies, 95):>9.2f} "
+                  f"{_percentile(latencies, 99):>9.2f} {max(latencies):>9.2f}")
+
+
+def main():
+    config.redis_client = None      # keep delivery local to this process
+    asyncio.run(_bench())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Move existing messages from Conversation ─IN_CONVERSATION→ edges into
+MessageBuckets (Conversation ─HAS_BUCKET→ MessageBucket ←IN_BUCKET─ Message).
+
+Messages need a `seq` first, so run the sequence backfill before this:
+
+    python -m scripts.backfill_message_seq
+    python -m scripts.migrate_message_buckets [--batch-size 1000]
+    python -m scripts.backfill_last_messages
+
+Work is done in small batches per conversation so no single transaction
+touches a whole supernode; the script is safe to re-run until it reports
+nothing left to move.
+"""
+
+import argparse
+import sys
+
+from neomodel import db
+
+from app.config import MESSAGE_BUCKET_SIZE
+from app.models.message import BUCKET_MERGE
+
+MOVE_BATCH = """
+MATCH (c:Conversation {conversation_id: $cid})<-[old:IN_CONVERSATION]-(m:Message)
+WHERE m.seq IS NOT NULL
+WITH c, old, m LIMIT $batch_size
+WITH c, old, m, m.seq AS seq
+""" + BUCKET_MERGE + """
+MERGE (m)-[:IN_BUCKET]->(b)
+SET b.message_count = b.message_count + 1,
+    b.first_at = CASE WHEN b.first_at IS NULL OR m.timestamp < b.first_at THEN m.timestamp ELSE b.first_at END,
+    b.last_at = CASE WHEN b.last_at IS NULL OR m.timestamp > b.last_at THEN m.timestamp ELSE b.last_at END,
+    m.conversation_id = c.conversation_id
+DELETE old
+RETURN count(m)
+"""
+
+UNNUMBERED = """
+MATCH (:Conversation)<-[:IN_CONVERSATION]-(m:Message)
+WHERE m.seq IS NULL
+RETURN count(m)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    results, _ = db.cypher_query(UNNUMBERED)
+    if results and results[0][0]:
+        print(f"❌ {results[0][0]} message(s) have no seq; run scripts.backfill_message_seq first")
+        return 1
+
+    conversations, _ = db.cypher_query("MATCH (c:Conversation) RETURN c.conversation_id")
+    moved_total = 0
+    for (cid,) in conversations:
+        while True:
+            results, _ = db.cypher_query(MOVE_BATCH, {
+                "cid": cid,
+                "batch_size": args.batch_size,
+                "bucket_size": MESSAGE_BUCKET_SIZE,
+            })
+            moved = results[0][0] if results else 0
+            moved_total += moved
+            if moved < args.batch_size:
+                break
+        print(f"[ℹ️] {cid} migrated")
+
+    print(f"✅ Moved {moved_total} message(s) into buckets of {MESSAGE_BUCKET_SIZE}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,12 +3,11 @@ import asyncio, websockets, json
 async def test_ws():
     # Replace with real IDs when testing manually
     conversation_id = input("Conversation ID: ")
-    sender_id = input("Sender ID: ")
+    token = input("Access token: ")
 
-    uri = f"ws://soceyo.onrender.com/ws/conversations/{conversation_id}"
+    uri = f"ws://soceyo.onrender.com/ws/conversations/{conversation_id}?token={token}"
     async with websockets.connect(uri) as websocket:
         await websocket.send(json.dumps({
-            "sender_id": sender_id,
             "content": "Hello backend!"
         }))
         reply = await websocket.recv()